@@ -5,53 +5,178 @@
 负责同步 SillyTavern 数据到本地 Git 仓库并推送到 GitHub
 """
 
+import json
 import logging
 import os
 import shutil
+import stat
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 import git
 
+try:
+    import xxhash
+except ImportError:  # 可选依赖：未安装时手动同步只按大小和修改时间判断
+    xxhash = None
+
+from config import resolve_data_path
+
 logger = logging.getLogger(__name__)
 
+# 目录名到文件类别的映射（聊天记录、角色卡）
+CATEGORY_DIRS = {'chats': 'chat', 'group chats': 'chat', 'characters': 'character'}
+
+# 文件名中包含这些关键字的视为配置文件
+CONFIG_MARKERS = ('settings', 'config', 'preset')
+
+# 同步时整体跳过的目录（缓存、日志、依赖等，可通过 sync_exclude_dirs 配置覆盖）
+SKIP_DIRS = frozenset(('.git', 'node_modules', '__pycache__', '.cache', 'logs'))
+
+
+def categorize_path(filepath: str) -> Optional[str]:
+    """
+    根据路径判断文件类别
+    返回：'chat' / 'character' / 'config'，无法归类时返回 None
+    """
+    *dirs, filename = filepath.split('/')
+    
+    # 按所在目录归类
+    for part in dirs:
+        category = CATEGORY_DIRS.get(part)
+        if category:
+            return category
+    
+    # 按文件名归类
+    filename = filename.lower()
+    if 'chat' in filename:
+        return 'chat'
+    if 'character' in filename:
+        return 'character'
+    if any(marker in filename for marker in CONFIG_MARKERS):
+        return 'config'
+    return None
+
+
+def file_digest(path: str) -> str:
+    """计算文件内容的 xxh3-64 指纹（十六进制），用于判断修改时间变化的文件内容是否真的改变"""
+    digest = xxhash.xxh3_64()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fast_copy(src: str, dst: str, src_stat: os.stat_result):
+    """
+    复制文件内容并保留修改时间
+    使用内核态 sendfile 传输数据，时间戳用一次 utime 写入；
+    不复制 xattr/ACL（Git 备份不会记录这些信息），省去 shutil.copy2 额外的 stat/copystat
+    """
+    src_fd = os.open(src, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        dst_fd = os.open(
+            dst,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0),
+            stat.S_IMODE(src_stat.st_mode)
+        )
+        try:
+            copied = False
+            if hasattr(os, 'sendfile'):
+                offset = 0
+                try:
+                    while offset < src_stat.st_size:
+                        sent = os.sendfile(dst_fd, src_fd, offset, src_stat.st_size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                    copied = True
+                except OSError:
+                    # 部分文件系统不支持 sendfile，尚未写入数据时改用普通读写
+                    if offset:
+                        raise
+            
+            if not copied:
+                while True:
+                    chunk = os.read(src_fd, 1024 * 1024)
+                    if not chunk:
+                        break
+                    os.write(dst_fd, chunk)
+            
+            times = (src_stat.st_atime_ns, src_stat.st_mtime_ns)
+            if os.utime in os.supports_fd:
+                os.utime(dst_fd, ns=times)
+            else:
+                os.close(dst_fd)
+                dst_fd = None
+                os.utime(dst, ns=times)
+        finally:
+            if dst_fd is not None:
+                os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
 
 class BackupManager:
     """备份管理器"""
     
+    # git diff 状态码到提交消息中变更类型的映射
+    _STATUS_LABELS = {'A': '新增', 'D': '删除', 'R': '重命名', 'C': '新增'}
+    
+    # 备份仓库的本地 git 配置
+    _REPO_SETTINGS = {
+        # 松散对象超过 256 个就自动打包（git 默认 6700）
+        ('gc', 'auto'): 256,
+        # 打包（推送、gc、repack）时使用最高 zlib 压缩级别，JSONL 文本压缩收益明显
+        ('pack', 'compression'): 9,
+    }
+    
     def __init__(self, config: Dict):
         """初始化备份管理器"""
         self.config = config
         
-        # Docker 环境检测
-        is_docker = os.path.exists('/.dockerenv')
-        
-        if is_docker:
-            # 容器内运行，使用固定的容器内路径
-            self.data_path = Path('/data')
-            logger.info("Docker 环境：使用容器内数据路径 /data")
-        else:
-            # 宿主机运行，使用配置的路径
-            self.data_path = Path(config['sillytavern_data_path'])
-            logger.info(f"宿主机环境：使用配置路径 {self.data_path}")
+        # 数据目录（Docker / 宿主机）由配置模块统一解析
+        self.data_path = resolve_data_path(config['sillytavern_data_path'])
         
         self.repo_path = Path(config['backup_repo_path'])
         self.remote_url = config['github_remote_url']
         self.repo = None
+        self._auth_applied = None  # 已应用的 (remote_url, github_token)
+        
+        # 同步时跳过的目录名（.git 始终跳过，避免覆盖备份仓库自身）
+        self.skip_dirs = frozenset(config.get('sync_exclude_dirs') or SKIP_DIRS) | {'.git'}
+        
+        # 后台推送（守护进程模式）
+        self._push_executor = None
+        self._pending_push = None
+        
+        # 比较索引的后台预热线程（菜单使用），以及串行化比较索引写入的锁
+        self._prefetch_thread = None
+        self._compare_index_lock = threading.Lock()
     
     def init_repo(self):
-        """初始化或打开 Git 仓库"""
+        """初始化或打开 Git 仓库
+        
+        仓库对象在多次备份之间复用，只有远程地址或 Token 变化时才重新配置
+        """
         try:
-            if self.repo_path.exists() and (self.repo_path / '.git').exists():
-                # 打开现有仓库
-                self.repo = git.Repo(self.repo_path)
+            auth_key = (self.remote_url, self.config.get('github_token'))
+            
+            if self.repo is not None:
+                if self._auth_applied == auth_key:
+                    return True
+            elif self.repo_path.exists() and (self.repo_path / '.git').exists():
+                # 打开现有仓库（GitCmdObjectDB 复用常驻的 cat-file 进程读取对象）
+                self.repo = git.Repo(self.repo_path, odbt=git.GitCmdObjectDB)
                 logger.info(f"已打开现有仓库: {self.repo_path}")
             else:
                 # 创建新仓库
                 self.repo_path.mkdir(parents=True, exist_ok=True)
-                self.repo = git.Repo.init(self.repo_path)
+                self.repo = git.Repo.init(self.repo_path, odbt=git.GitCmdObjectDB)
                 logger.info(f"已创建新仓库: {self.repo_path}")
                 
                 # 配置远程仓库
@@ -67,6 +192,8 @@ class BackupManager:
             
             # 配置 GitHub Token 认证（如果使用 HTTPS）
             self._setup_git_auth()
+            self._setup_repo_config()
+            self._auth_applied = auth_key
             
             return True
         except Exception as e:
@@ -95,6 +222,61 @@ class BackupManager:
         else:
             logger.warning("未检测到 GitHub Token，如果使用 HTTPS 可能需要手动认证")
     
+    def _setup_repo_config(self):
+        """写入备份仓库的本地 git 配置（已是目标值的项不重复写入）"""
+        reader = self.repo.config_reader()
+        pending = [
+            (section, option, value)
+            for (section, option), value in self._REPO_SETTINGS.items()
+            if reader.get_value(section, option, '') != value
+        ]
+        if pending:
+            with self.repo.config_writer() as writer:
+                for section, option, value in pending:
+                    writer.set_value(section, option, str(value))
+    
+    def _auto_gc(self):
+        """执行 git gc --auto（未达到阈值时 git 会立即返回），失败不影响备份结果"""
+        try:
+            self.repo.git.gc('--auto')
+        except git.exc.GitCommandError as e:
+            logger.warning(f"自动整理仓库失败: {e}")
+    
+    def _write_commit_graph(self, split='--split'):
+        """
+        写入 commit-graph（含变更路径的布隆过滤器），失败不影响备份结果
+        git log 列出备份时直接从 commit-graph 读取父提交和时间，不必逐个解包提交对象
+        默认 --split 只为新提交追加一层；--split=replace 合并为单个文件
+        """
+        try:
+            self.repo.git.commit_graph('write', '--reachable', '--changed-paths', split)
+        except git.exc.GitCommandError as e:
+            logger.warning(f"写入 commit-graph 失败: {e}")
+    
+    def repack_repo(self):
+        """
+        完整重新打包备份仓库（每周定时任务）
+        把所有对象压缩进单个 pack，删除冗余对象，保持 .git 体积和对象查找速度
+        """
+        try:
+            # 不与进行中的后台推送同时操作仓库
+            if not self._wait_pending_push():
+                raise Exception("上一次推送尚未完成")
+            
+            if not self.init_repo():
+                raise Exception("仓库初始化失败")
+            
+            logger.info("开始重新打包备份仓库...")
+            # pack.threads=0：按 CPU 核数自动选择压缩线程数
+            self.repo.git(c='pack.threads=0').repack('-Ad', '--depth=250', '--window=250')
+            # 重新打包后把各层 commit-graph 合并为一个文件
+            self._write_commit_graph('--split=replace')
+            logger.info("备份仓库重新打包完成")
+            return True
+        except Exception as e:
+            logger.error(f"重新打包仓库失败: {e}")
+            return False
+    
     def sync_files(self):
         """
         同步文件从源目录到备份仓库
@@ -109,15 +291,28 @@ class BackupManager:
             
             # 方案 1: 使用 rsync（如果系统有）
             if shutil.which('rsync'):
-                cmd = [
-                    'rsync', '-av', '--delete',
-                    '--exclude', '.git',  # 排除 .git 目录
+                debug = logger.isEnabledFor(logging.DEBUG)
+                # 本地到本地复制：-W 跳过增量算法，--inplace 直接写入目标文件
+                # （崩溃安全由后续 Git 提交保证，不需要临时文件 + 重命名）
+                cmd = ['rsync', '-aW', '--delete', '--inplace', '--no-compress']
+                # 排除 .git 及缓存等目录（被排除的目录在目标中也不会被删除）
+                cmd += [f'--exclude={name}/' for name in sorted(self.skip_dirs)]
+                if debug:
+                    cmd += ['-v', '--info=stats2']
+                cmd += [
                     str(self.data_path),  # 不带末尾斜杠，保留 data 文件夹
                     str(self.repo_path) + '/'
                 ]
-                result = subprocess.run(cmd, capture_output=True, text=True)
+                result = subprocess.run(
+                    cmd,
+                    stdout=subprocess.PIPE if debug else subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                    text=True
+                )
                 if result.returncode != 0:
                     raise Exception(f"rsync 失败: {result.stderr}")
+                if debug:
+                    logger.debug(f"rsync 输出:\n{result.stdout}")
                 logger.info("文件同步完成 (rsync)")
             else:
                 # 方案 2: 使用 Python 手动同步
@@ -130,23 +325,182 @@ class BackupManager:
             return False
     
     def _manual_sync(self):
-        """手动同步文件（当 rsync 不可用时）"""
-        # 复制所有文件
-        for item in self.data_path.rglob('*'):
-            if item.is_file():
-                relative_path = item.relative_to(self.data_path)
-                target = self.repo_path / relative_path
-                target.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(item, target)
+        """手动同步文件（当 rsync 不可用时）
+        
+        与 rsync 的 quick-check 相同：大小和修改时间都一致的文件视为未变更，直接跳过；
+        安装了 xxhash 时，只有修改时间变化的文件再按内容指纹判断，内容未变则不复制
+        """
+        # 与 rsync 保持一致，同步到 <repo>/<data 目录名>/ 下
+        target_root = self.repo_path / self.data_path.name
+        index = self._load_sync_index()
+        seen = {}  # 相对路径 -> 指纹记录（没有记录时为 None）
+        copy_tasks = []
+        
+        # 单次遍历源目录，收集有变化的文件
+        self._sync_dir(str(self.data_path), str(target_root), '', seen, copy_tasks, index)
+        
+        # 并行复制：系统调用期间会释放 GIL，小文件多时线程能有效利用磁盘队列
+        if copy_tasks:
+            workers = self.config.get('sync_workers') or min(8, (os.cpu_count() or 1) * 2)
+            copied_count = 0
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for rel_path, record, copied in executor.map(
+                    lambda task: self._sync_file(*task), copy_tasks
+                ):
+                    seen[rel_path] = record
+                    copied_count += copied
+            logger.debug(
+                f"已复制 {copied_count} 个变更文件，"
+                f"{len(copy_tasks) - copied_count} 个文件内容未变化"
+            )
         
         # 删除目标中多余的文件
-        for item in self.repo_path.rglob('*'):
-            if item.is_file() and '.git' not in item.parts:
-                relative_path = item.relative_to(self.repo_path)
-                source = self.data_path / relative_path
-                if not source.exists():
-                    item.unlink()
-                    logger.debug(f"删除多余文件: {relative_path}")
+        if target_root.exists():
+            deleted_count = self._prune_dir(
+                str(target_root), '', seen, logger.isEnabledFor(logging.DEBUG)
+            )
+            if deleted_count:
+                logger.info(f"同步完成，删除 {deleted_count} 个多余文件")
+        
+        if xxhash is not None:
+            self._save_sync_index(seen)
+    
+    @property
+    def _sync_index_path(self):
+        """指纹记录放在 .git 目录内，不会被 git add -A 提交"""
+        return os.path.join(self.repo_path, '.git', 'sync_index.json')
+    
+    def _load_sync_index(self):
+        """
+        读取上次手动同步的指纹记录
+        格式：{相对路径: [大小, 源文件修改时间, 内容指纹, 目标文件修改时间]}
+        """
+        if xxhash is None:
+            return {}
+        try:
+            with open(self._sync_index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def _save_sync_index(self, seen):
+        """写入指纹记录（先写临时文件再替换，中途失败不会留下损坏的记录）"""
+        index = {rel_path: record for rel_path, record in seen.items() if record}
+        tmp_path = self._sync_index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self._sync_index_path)
+    
+    def _sync_dir(self, src_dir, dst_dir, rel_dir, seen, copy_tasks, index):
+        """递归收集 src_dir 中有变化的文件，并记录遇到的相对路径及仍然有效的指纹"""
+        with os.scandir(src_dir) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                target = os.path.join(dst_dir, entry.name)
+                
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in self.skip_dirs:
+                        continue
+                    self._sync_dir(entry.path, target, rel_path, seen, copy_tasks, index)
+                elif entry.is_file():
+                    src_stat = entry.stat()  # scandir 已缓存
+                    try:
+                        dst_stat = os.stat(target)
+                    except FileNotFoundError:
+                        dst_stat = None
+                    
+                    # 目标文件自记录以来被改动过（或大小已不同），指纹作废
+                    record = index.get(rel_path)
+                    if record and (dst_stat is None
+                                   or record[3] != dst_stat.st_mtime_ns
+                                   or record[0] != dst_stat.st_size
+                                   or record[0] != src_stat.st_size):
+                        record = None
+                    seen[rel_path] = record
+                    
+                    if dst_stat is not None and (
+                            dst_stat.st_size == src_stat.st_size
+                            and dst_stat.st_mtime_ns == src_stat.st_mtime_ns):
+                        continue
+                    if record and record[1] == src_stat.st_mtime_ns:
+                        # 上次同步已确认内容与备份相同
+                        continue
+                    
+                    # 目录在遍历时串行创建，指纹计算和复制交给线程池
+                    os.makedirs(dst_dir, exist_ok=True)
+                    copy_tasks.append((entry.path, target, src_stat, rel_path, record))
+    
+    def _sync_file(self, src, dst, src_stat, rel_path, record):
+        """
+        同步单个文件，返回 (相对路径, 新的指纹记录, 是否复制)
+        内容指纹与上次记录相同时（只有修改时间变化）跳过复制
+        """
+        if xxhash is None:
+            fast_copy(src, dst, src_stat)
+            return rel_path, None, True
+        
+        digest = file_digest(src)
+        if record and record[2] == digest:
+            return rel_path, [src_stat.st_size, src_stat.st_mtime_ns, digest, record[3]], False
+        
+        fast_copy(src, dst, src_stat)
+        return rel_path, [src_stat.st_size, src_stat.st_mtime_ns, digest, src_stat.st_mtime_ns], True
+    
+    def _prune_dir(self, dst_dir, rel_dir, seen, log_each=False):
+        """递归删除目标目录中源目录已不存在的文件，返回删除的文件数"""
+        deleted_count = 0
+        with os.scandir(dst_dir) as entries:
+            for entry in entries:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in self.skip_dirs:
+                        continue
+                    deleted_count += self._prune_dir(entry.path, rel_path, seen, log_each)
+                elif rel_path not in seen:
+                    os.unlink(entry.path)
+                    deleted_count += 1
+                    if log_each:
+                        logger.debug(f"删除多余文件: {rel_path}")
+        return deleted_count
+    
+    def _has_staged_changes(self) -> bool:
+        """
+        用 git diff-index --quiet 检查暂存区是否有变更
+        只看退出码，遇到第一处差异即结束，不输出文件列表
+        """
+        if not self.repo.head.is_valid():
+            # 还没有任何提交：只要暂存区有文件就需要提交
+            return bool(self.repo.git.ls_files('-z'))
+        
+        status, _, _ = self.repo.git.diff_index(
+            '--quiet', '--cached', 'HEAD', '--',
+            with_extended_output=True, with_exceptions=False
+        )
+        return status != 0
+    
+    def _collect_changes(self):
+        """
+        解析 git diff --cached --name-status -z，一次获取已暂存的所有变更
+        返回：[(变更类型, 文件路径), ...]
+        """
+        # -M 开启重命名检测；未产生提交的新仓库会与空树比较
+        out = self.repo.git.diff('--cached', '--name-status', '-M', '-z')
+        
+        changed_files = []
+        tokens = iter(out.split('\0'))
+        for status in tokens:
+            if not status:
+                continue
+            
+            path = next(tokens, '')
+            if status[0] in ('R', 'C'):
+                # 重命名/复制："R100\0<旧路径>\0<新路径>"
+                path = next(tokens, path)
+            
+            changed_files.append((self._STATUS_LABELS.get(status[0], '修改'), path))
+        
+        return changed_files
     
     def commit_changes(self, custom_message=None):
         """提交变更到 Git
@@ -156,65 +510,47 @@ class BackupManager:
         """
         try:
             # 添加所有变更（包括删除）
-            self.repo.git.add(A=True)
+            self.repo.git.add('-A')
             
             # 检查是否有变更
-            if not self.repo.is_dirty(untracked_files=True):
+            if not self._has_staged_changes():
                 logger.info("没有变更需要提交")
                 return True
             
+            # 自定义消息不需要变更文件列表，跳过带重命名检测的完整 diff
+            changed_files = [] if custom_message else self._collect_changes()
+            
             # 如果有自定义消息，直接使用
             if custom_message:
                 commit_msg = custom_message
-                logger.info(f"使用自定义提交消息: {commit_msg.split(chr(10))[0]}")
+                summary = commit_msg.partition('\n')[0]
+                logger.info(f"使用自定义提交消息: {summary}")
             else:
-                # 获取变更文件列表
-                changed_files = []
-                
-                # 修改的文件
-                for item in self.repo.index.diff("HEAD"):
-                    changed_files.append(('修改', item.a_path))
-                
-                # 新增的文件
-                for item in self.repo.untracked_files:
-                    changed_files.append(('新增', item))
-                
-                # 删除的文件（通过 diff 获取）
-                try:
-                    diff_result = self.repo.git.diff("--name-status", "HEAD")
-                    for line in diff_result.split('\n'):
-                        if line.startswith('D\t'):
-                            changed_files.append(('删除', line[2:]))
-                except:
-                    pass
-                
                 # 分析变更内容
-                chat_changes = []
-                character_changes = []
-                other_changes = []
+                buckets = {'chat': [], 'character': [], 'config': []}
                 
                 for change_type, filepath in changed_files:
-                    # 聊天记录变化
-                    if 'chats/' in filepath or 'chat' in filepath.lower():
-                        # 提取角色名（通常在文件名中）
-                        filename = filepath.split('/')[-1]
-                        # 移除扩展名和日期戳
-                        name = filename.replace('.jsonl', '').replace('.json', '')
-                        chat_changes.append(f"{change_type}:{name}")
-                    
-                    # 角色卡变化
-                    elif 'characters/' in filepath or 'character' in filepath.lower():
-                        filename = filepath.split('/')[-1]
-                        name = filename.replace('.png', '').replace('.json', '')
-                        character_changes.append(f"{change_type}:{name}")
+                    category = categorize_path(filepath)
+                    if category is None:
+                        continue
                     
-                    # 其他重要文件
-                    elif any(x in filepath for x in ['settings', 'config', 'preset']):
-                        other_changes.append(filepath.split('/')[-1])
+                    filename = filepath.rpartition('/')[2]
+                    if category == 'config':
+                        # 其他重要文件：保留完整文件名
+                        buckets['config'].append(filename)
+                    else:
+                        # 聊天记录 / 角色卡：去掉扩展名作为名称
+                        name = os.path.splitext(filename)[0]
+                        buckets[category].append(f"{change_type}:{name}")
+                
+                chat_changes = buckets['chat']
+                character_changes = buckets['character']
+                other_changes = buckets['config']
                 
                 # 构建提交消息
                 timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                commit_msg = f"自动备份 {timestamp}"
+                summary = f"自动备份 {timestamp}"
+                parts = [summary]
                 
                 # 添加变更摘要
                 details = []
@@ -237,140 +573,224 @@ class BackupManager:
                     details.append(f"配置: {', '.join(other_changes[:3])}")
                 
                 if details:
-                    commit_msg += "\n\n" + '\n'.join(details)
+                    parts.append('\n'.join(details))
                 
                 # 添加统计信息
-                commit_msg += f"\n\n共 {len(changed_files)} 个文件变更"
+                parts.append(f"共 {len(changed_files)} 个文件变更")
+                commit_msg = '\n\n'.join(parts)
             
             # 提交
             self.repo.index.commit(commit_msg)
-            logger.info(f"已提交变更: {commit_msg.split(chr(10))[0]}")  # 只记录第一行
+            logger.info(f"已提交变更: {summary}")  # 只记录第一行
             
             return True
         except Exception as e:
             logger.error(f"提交变更失败: {e}")
             return False
-        """提交变更到 Git"""
+    
+    def push_to_remote(self):
+        """推送到远程仓库
+        
+        直接调用 git push --porcelain 并解析机器可读的结果，
+        显式指定目标分支，首次推送也无需先设置上游分支
+        """
         try:
-            # 添加所有变更（包括删除）
-            self.repo.git.add(A=True)
-            
-            # 检查是否有变更
-            if not self.repo.is_dirty(untracked_files=True):
-                logger.info("没有变更需要提交")
-                return True
-            
-            # 获取变更文件列表
-            changed_files = []
-            
-            # 修改的文件
-            for item in self.repo.index.diff("HEAD"):
-                changed_files.append(('修改', item.a_path))
-            
-            # 新增的文件
-            for item in self.repo.untracked_files:
-                changed_files.append(('新增', item))
-            
-            # 删除的文件（通过 diff 获取）
-            try:
-                diff_result = self.repo.git.diff("--name-status", "HEAD")
-                for line in diff_result.split('\n'):
-                    if line.startswith('D\t'):
-                        changed_files.append(('删除', line[2:]))
-            except:
-                pass
-            
-            # 分析变更内容
-            chat_changes = []
-            character_changes = []
-            other_changes = []
-            
-            for change_type, filepath in changed_files:
-                # 聊天记录变化
-                if 'chats/' in filepath or 'chat' in filepath.lower():
-                    # 提取角色名（通常在文件名中）
-                    filename = filepath.split('/')[-1]
-                    # 移除扩展名和日期戳
-                    name = filename.replace('.jsonl', '').replace('.json', '')
-                    chat_changes.append(f"{change_type}:{name}")
-                
-                # 角色卡变化
-                elif 'characters/' in filepath or 'character' in filepath.lower():
-                    filename = filepath.split('/')[-1]
-                    name = filename.replace('.png', '').replace('.json', '')
-                    character_changes.append(f"{change_type}:{name}")
-                
-                # 其他重要文件
-                elif any(x in filepath for x in ['settings', 'config', 'preset']):
-                    other_changes.append(filepath.split('/')[-1])
-            
-            # 构建提交消息
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            commit_msg = f"自动备份 {timestamp}"
-            
-            # 添加变更摘要
-            details = []
-            if chat_changes:
-                # 限制显示数量，避免消息过长
-                shown_chats = chat_changes[:5]
-                chat_summary = ', '.join(shown_chats)
-                if len(chat_changes) > 5:
-                    chat_summary += f" 等{len(chat_changes)}个"
-                details.append(f"聊天: {chat_summary}")
-            
-            if character_changes:
-                shown_chars = character_changes[:3]
-                char_summary = ', '.join(shown_chars)
-                if len(character_changes) > 3:
-                    char_summary += f" 等{len(character_changes)}个"
-                details.append(f"角色: {char_summary}")
-            
-            if other_changes:
-                details.append(f"配置: {', '.join(other_changes[:3])}")
-            
-            if details:
-                commit_msg += "\n\n" + '\n'.join(details)
-            
-            # 添加统计信息
-            commit_msg += f"\n\n共 {len(changed_files)} 个文件变更"
+            current_branch = self.repo.active_branch.name
+            output = self.repo.git.push(
+                '--porcelain', '--no-verify',
+                'origin', f'HEAD:refs/heads/{current_branch}'
+            )
             
-            # 提交
-            self.repo.index.commit(commit_msg)
-            logger.info(f"已提交变更: {commit_msg.split(chr(10))[0]}")  # 只记录第一行
+            # 结果行格式: "<flag>\t<from>:<to>\t<summary>"
+            for line in output.splitlines():
+                flag, sep, detail = line.partition('\t')
+                if not sep:
+                    continue
+                if flag == '!':
+                    raise Exception(f"推送被拒绝: {detail}")
+                if flag == '=':
+                    logger.info("远程仓库已是最新")
+                else:
+                    logger.info(f"已推送到远程仓库: {current_branch}")
             
             return True
         except Exception as e:
-            logger.error(f"提交变更失败: {e}")
+            logger.error(f"推送到远程仓库失败: {e}")
             return False
     
-    def push_to_remote(self):
-        """推送到远程仓库"""
-        try:
-            origin = self.repo.remote('origin')
-            
-            # 首次推送可能需要设置上游分支
+    def _compare_env(self):
+        """比较索引使用的环境变量：独立的索引文件，工作区指向数据目录的上级目录"""
+        return {
+            'GIT_INDEX_FILE': os.path.join(self.repo.git_dir, 'compare_index'),
+            'GIT_WORK_TREE': str(self.data_path.parent),
+        }
+    
+    def _refresh_compare_index(self, commit_hash='HEAD'):
+        """把备份树读入比较索引，并刷新本地文件的 stat 信息（调用方需持有 _compare_index_lock）"""
+        env = self._compare_env()
+        # --reset：与索引中内容相同的条目沿用已有的 stat 信息
+        self.repo.git.read_tree('--reset', commit_hash, env=env)
+        # 刷新 stat 信息并写回索引（有差异的文件会让命令返回非零，属正常情况）
+        self.repo.git.update_index('-q', '--refresh', env=env, with_exceptions=False)
+    
+    def prefetch_compare_index(self):
+        """
+        在后台线程中按最新备份预热比较索引
+        用户选择版本期间先为本地文件计算哈希，之后的 compare_with_local 只需处理差异部分
+        """
+        # 上一次预热仍在进行时不再启动新的线程
+        if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+            return
+        
+        def worker():
             try:
-                origin.push()
-                logger.info("已推送到远程仓库")
-            except git.exc.GitCommandError as e:
-                if 'no upstream branch' in str(e).lower():
-                    # 设置上游分支并推送
-                    current_branch = self.repo.active_branch.name
-                    origin.push(refspec=f'{current_branch}:{current_branch}', set_upstream=True)
-                    logger.info(f"已设置上游分支并推送: {current_branch}")
-                else:
-                    raise
+                with self._compare_index_lock:
+                    self._refresh_compare_index('HEAD')
+            except Exception as e:
+                logger.debug(f"预热比较索引失败: {e}")
+        
+        self._prefetch_thread = threading.Thread(target=worker, name='compare-prefetch', daemon=True)
+        self._prefetch_thread.start()
+    
+    def wait_prefetch(self):
+        """等待后台预热结束（菜单取消比较时调用，避免返回后仍有进程在写比较索引）"""
+        if self._prefetch_thread is not None:
+            self._prefetch_thread.join()
+            self._prefetch_thread = None
+    
+    @staticmethod
+    def _iter_raw_diff(out):
+        """
+        解析 --raw -z 格式的差异输出
+        逐条产出 (状态, 旧对象 OID, 新对象 OID, 路径)，OID 由 git 直接从树对象中给出，无需再按路径查找
+        """
+        tokens = iter(out.split('\0'))
+        for header in tokens:
+            if not header:
+                continue
+            path = next(tokens, '')
+            # 头部格式：:<旧模式> <新模式> <旧 OID> <新 OID> <状态>
+            _, _, oid_a, oid_b, status = header.lstrip(':').split(' ')
+            yield status, oid_a, oid_b, path
+    
+    def _blob_size(self, oid):
+        """按 OID 读取对象大小（经由持久的 cat-file --batch-check 进程，不展开树、不读取内容）"""
+        return self.repo.odb.info(bytes.fromhex(oid)).size
+    
+    def compare_with_local(self, commit_hash='HEAD'):
+        """
+        比较指定备份与当前 SillyTavern 数据
+        把备份树读入独立的比较索引，由 git 直接对比数据目录，不检出版本、不改动备份仓库的工作区
+        
+        比较索引保存在 .git/compare_index 并在多次比较之间复用：
+        内容未变的条目保留上次记录的 stat 信息，只有 stat 变化的本地文件才需要重新计算哈希
+        
+        返回：(仅本地存在, 内容不同, 仅备份存在)
+            路径均相对于数据目录；内容不同的条目为 (路径, 备份中大小, 本地大小)
+        """
+        prefix = self.data_path.name + '/'
+        env = self._compare_env()
+        
+        # 等待后台预热结束；锁保证同一时刻只有一个 git 进程在写比较索引（diff 也可能顺带写回 stat 信息）
+        self.wait_prefetch()
+        
+        with self._compare_index_lock:
+            self._refresh_compare_index(commit_hash)
             
+            # 已跟踪文件：修改 / 删除（按内容比较，仅时间戳变化的文件不会被报告）
+            diff_out = self.repo.git.diff(
+                '--raw', '--no-abbrev', '--no-renames', '-z', '--', prefix, env=env
+            )
+            # 备份中没有的本地文件
+            # 不用 --exclude-standard：工作区是数据目录的上级目录，宿主机 SillyTavern 的 .gitignore 会忽略 data/；
+            # 只排除同步时同样会跳过的目录，结果与下次备份会纳入的文件一致
+            others_out = self.repo.git.ls_files(
+                '--others', '-z',
+                *[f'--exclude={name}/' for name in sorted(self.skip_dirs)],
+                '--', prefix, env=env
+            )
+        
+        added = [path[len(prefix):] for path in others_out.split('\0') if path]
+        modified = []
+        deleted = []
+        
+        for status, oid_backup, _, path in self._iter_raw_diff(diff_out):
+            rel_path = path[len(prefix):]
+            if status == 'D':
+                deleted.append(rel_path)
+            else:
+                # 本地一侧的 OID 为全零（git 不为工作区文件落地对象），大小直接取 stat
+                try:
+                    local_size = (self.data_path / rel_path).stat().st_size
+                except FileNotFoundError:
+                    # 比较期间文件被删除（例如 SillyTavern 正在写入）：按仅备份中存在处理
+                    deleted.append(rel_path)
+                    continue
+                modified.append((rel_path, self._blob_size(oid_backup), local_size))
+        
+        return added, modified, deleted
+    
+    def compare_commits(self, commit_a, commit_b):
+        """
+        比较两个备份版本的数据目录
+        git diff-tree 直接比较两棵提交树，只展开发生变化的子树
+        
+        返回：(仅 B 中存在, 内容不同, 仅 A 中存在)
+            路径均相对于数据目录；内容不同的条目为 (路径, A 中大小, B 中大小)
+        """
+        prefix = self.data_path.name + '/'
+        out = self.repo.git.diff_tree(
+            '-r', '-z', '--raw', '--no-abbrev', '--no-renames', commit_a, commit_b, '--', prefix
+        )
+        
+        added = []
+        modified = []
+        deleted = []
+        
+        for status, oid_a, oid_b, path in self._iter_raw_diff(out):
+            rel_path = path[len(prefix):]
+            if status == 'A':
+                added.append(rel_path)
+            elif status == 'D':
+                deleted.append(rel_path)
+            else:
+                modified.append((rel_path, self._blob_size(oid_a), self._blob_size(oid_b)))
+        
+        return added, modified, deleted
+    
+    def _wait_pending_push(self):
+        """等待上一次后台推送结束，返回是否可以开始新的备份"""
+        if self._pending_push is None:
             return True
-        except Exception as e:
-            logger.error(f"推送到远程仓库失败: {e}")
+        
+        timeout = self.config.get('push_timeout', 600)
+        try:
+            if not self._pending_push.result(timeout=timeout):
+                logger.warning("上一次后台推送失败，本次备份完成后会一并推送")
+        except FutureTimeoutError:
+            logger.error(f"上一次后台推送超过 {timeout} 秒仍未完成，跳过本次备份")
+            return False
+        except Exception:
+            # 后台任务本身抛出异常（例如 gc / commit-graph 出错）：记录后按推送失败处理，不影响本次备份
+            logger.exception("上一次后台推送异常，本次备份完成后会一并推送")
+
+        self._pending_push = None
+        return True
+    
+    def _push_and_gc(self):
+        """推送到远程仓库，成功后顺带执行 git gc --auto 并为新提交追加 commit-graph"""
+        if not self.push_to_remote():
             return False
+        self._auto_gc()
+        self._write_commit_graph()
+        return True
     
-    def run_backup(self, custom_message=None):
+    def run_backup(self, custom_message=None, background_push=False):
         """执行完整的备份流程
         
         Args:
             custom_message: 自定义提交消息（可选）
+            background_push: 是否在后台推送（守护进程使用；下次备份开始前会等待推送结束）
         """
         start_time = datetime.now()
         logger.info("=" * 50)
@@ -378,6 +798,10 @@ class BackupManager:
         logger.info("=" * 50)
         
         try:
+            # 0. 等待上一次的后台推送（避免两个 git 操作同时进行）
+            if not self._wait_pending_push():
+                raise Exception("上一次推送尚未完成")
+            
             # 1. 初始化仓库
             if not self.init_repo():
                 raise Exception("仓库初始化失败")
@@ -391,42 +815,15 @@ class BackupManager:
                 raise Exception("提交变更失败")
             
             # 4. 推送到远程
-            if not self.push_to_remote():
-                raise Exception("推送到远程仓库失败")
-            
-            # 计算耗时
-            elapsed = (datetime.now() - start_time).total_seconds()
-            logger.info("=" * 50)
-            logger.info(f"备份完成！耗时: {elapsed:.2f} 秒")
-            logger.info("=" * 50)
-            
-            return True
-        except Exception as e:
-            logger.error("=" * 50)
-            logger.error(f"备份失败: {e}")
-            logger.error("=" * 50)
-            return False
-        """执行完整的备份流程"""
-        start_time = datetime.now()
-        logger.info("=" * 50)
-        logger.info(f"开始备份 - {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
-        logger.info("=" * 50)
-        
-        try:
-            # 1. 初始化仓库
-            if not self.init_repo():
-                raise Exception("仓库初始化失败")
-            
-            # 2. 同步文件
-            if not self.sync_files():
-                raise Exception("文件同步失败")
-            
-            # 3. 提交变更
-            if not self.commit_changes():
-                raise Exception("提交变更失败")
-            
-            # 4. 推送到远程
-            if not self.push_to_remote():
+            if background_push:
+                # 网络推送交给后台线程，不阻塞本次备份的收尾
+                if self._push_executor is None:
+                    self._push_executor = ThreadPoolExecutor(
+                        max_workers=1, thread_name_prefix='push'
+                    )
+                self._pending_push = self._push_executor.submit(self._push_and_gc)
+                logger.info("已在后台开始推送到远程仓库")
+            elif not self._push_and_gc():
                 raise Exception("推送到远程仓库失败")
             
             # 计算耗时
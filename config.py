@@ -8,11 +8,73 @@
 import os
 import json
 import logging
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, Any
 
 logger = logging.getLogger(__name__)
 
+# Docker 环境检测（进程生命周期内不会变化，导入时检测一次）
+IS_DOCKER = os.path.exists('/.dockerenv')
+
+# 容器内固定的数据挂载点
+DOCKER_DATA_PATH = Path('/data')
+
+
+def _parse_bool(value) -> bool:
+    """解析布尔配置（环境变量中为字符串）"""
+    return str(value).lower() in ('true', '1', 'yes')
+
+
+def _parse_optional_bool(value):
+    """解析可留空的布尔配置：未设置或为空时返回 None（交给调用方自动判断）"""
+    if value is None or value == '':
+        return None
+    return _parse_bool(value)
+
+
+def _parse_list(value) -> tuple:
+    """解析列表配置：配置文件中为数组，环境变量中为逗号分隔的字符串"""
+    if isinstance(value, str):
+        value = value.split(',')
+    return tuple(item.strip() for item in value if item.strip())
+
+
+# 配置项定义：(配置键, 环境变量名, 默认值, 类型转换)
+CONFIG_SCHEMA = (
+    ('sillytavern_data_path', 'ST_DATA_PATH', '/var/sillytavern/data', Path),
+    ('backup_repo_path', 'BACKUP_REPO_PATH', '/var/backups/sillytavern-backup', Path),
+    ('github_remote_url', 'GITHUB_REMOTE_URL', '', str),
+    ('github_token', 'GITHUB_TOKEN', '', str),
+    ('backup_time', 'BACKUP_TIME', '03:00', str),
+    ('max_log_size_mb', 'MAX_LOG_SIZE_MB', 10, int),
+    ('enable_auto_backup', 'AUTO_BACKUP_ENABLED', True, _parse_bool),
+    ('trigger_mode', 'TRIGGER_MODE', 'cron', str),
+    ('watch_debounce_seconds', 'WATCH_DEBOUNCE_SECONDS', 30, int),
+    ('watch_force_polling', 'WATCH_FORCE_POLLING', None, _parse_optional_bool),
+    ('push_timeout', 'PUSH_TIMEOUT', 600, int),
+    ('sync_workers', 'SYNC_WORKERS', 0, int),  # 0 表示按 CPU 数自动选择
+    ('sync_exclude_dirs', 'SYNC_EXCLUDE_DIRS', (), _parse_list),  # 为空时使用内置的 SKIP_DIRS
+    ('menu_prefetch', 'MENU_PREFETCH', True, _parse_bool),
+    ('restore_concurrency', 'RESTORE_CONCURRENCY', 8, int),
+    ('fetch_cache_seconds', 'FETCH_CACHE_SECONDS', 60, int),
+)
+
+
+@lru_cache(maxsize=None)
+def resolve_data_path(configured_path) -> Path:
+    """
+    解析 SillyTavern 数据目录的实际路径
+    容器内运行时固定使用 /data，宿主机使用配置的路径；结果按配置值缓存
+    """
+    if IS_DOCKER:
+        logger.info(f"Docker 环境：使用容器内数据路径 {DOCKER_DATA_PATH}")
+        return DOCKER_DATA_PATH
+    
+    data_path = Path(configured_path)
+    logger.info(f"宿主机环境：使用配置路径 {data_path}")
+    return data_path
+
 
 def load_config() -> Dict[str, Any]:
     """
@@ -34,55 +96,26 @@ def load_config() -> Dict[str, Any]:
         logger.info("配置文件不存在，将使用环境变量和默认值")
     
     # 2. 环境变量覆盖配置文件（优先级更高）
-    config['sillytavern_data_path'] = os.getenv(
-        'ST_DATA_PATH', 
-        config.get('sillytavern_data_path', '/var/sillytavern/data')
-    )
-    
-    config['backup_repo_path'] = os.getenv(
-        'BACKUP_REPO_PATH',
-        config.get('backup_repo_path', '/var/backups/sillytavern-backup')
-    )
-    
-    config['github_remote_url'] = os.getenv(
-        'GITHUB_REMOTE_URL',
-        config.get('github_remote_url', '')
-    )
-    
-    config['github_token'] = os.getenv(
-        'GITHUB_TOKEN',
-        config.get('github_token', '')
-    )
-    
-    config['backup_time'] = os.getenv(
-        'BACKUP_TIME',
-        config.get('backup_time', '03:00')
-    )
-    
-    config['max_log_size_mb'] = int(os.getenv(
-        'MAX_LOG_SIZE_MB',
-        str(config.get('max_log_size_mb', 10))
-    ))
-    
-    config['enable_auto_backup'] = os.getenv(
-        'AUTO_BACKUP_ENABLED',
-        str(config.get('enable_auto_backup', True))
-    ).lower() in ('true', '1', 'yes')
+    for key, env_name, default, cast in CONFIG_SCHEMA:
+        value = os.environ.get(env_name)
+        if value is None:
+            # 配置文件中的 null 视为未配置，使用默认值（否则 str(None) 会变成字符串 'None'）
+            value = config.get(key)
+            if value is None:
+                value = default
+        config[key] = cast(value)
     
     # 3. 验证必需配置
     if not config['github_remote_url']:
         raise ValueError("GitHub 仓库 URL 未配置！请设置 GITHUB_REMOTE_URL 环境变量或在 config.json 中配置")
     
-    # 4. 转换路径为 Path 对象
-    config['sillytavern_data_path'] = Path(config['sillytavern_data_path'])
-    config['backup_repo_path'] = Path(config['backup_repo_path'])
-    
     logger.info("配置加载完成")
     logger.debug(f"SillyTavern 数据路径: {config['sillytavern_data_path']}")
     logger.debug(f"备份仓库路径: {config['backup_repo_path']}")
     logger.debug(f"GitHub 仓库: {config['github_remote_url']}")
     logger.debug(f"备份时间: {config['backup_time']}")
     logger.debug(f"自动备份: {config['enable_auto_backup']}")
+    logger.debug(f"触发方式: {config['trigger_mode']}")
     
     return config
 
@@ -96,16 +129,8 @@ def validate_config(config: Dict) -> bool:
             logger.error(f"缺少必需的配置项: {field}")
             return False
     
-    # Docker 环境检测：如果在容器内运行，数据路径应该是容器内路径 /data
-    is_docker = os.path.exists('/.dockerenv')
-    
-    if is_docker:
-        # 容器内运行，检查容器内路径
-        data_path = Path('/data')  # 固定的容器内挂载点
-        logger.info("检测到 Docker 环境，使用容器内路径: /data")
-    else:
-        # 宿主机运行，使用配置的路径
-        data_path = Path(config['sillytavern_data_path'])
+    # 容器内运行时数据路径应该是容器内挂载点 /data
+    data_path = resolve_data_path(config['sillytavern_data_path'])
     
     if not data_path.exists():
         logger.error(f"SillyTavern 数据目录不存在: {data_path}")
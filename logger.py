@@ -4,17 +4,39 @@
 日志配置模块
 """
 
+import atexit
 import logging
+import queue
 import sys
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# 后台写日志的监听线程
+_listener = None
+
+
+def _stop_listener():
+    """停止监听线程，处理完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(_stop_listener)
 
 
 def setup_logger(log_level=logging.INFO):
     """
     配置日志系统
     同时输出到控制台和文件
+    控制台同步输出（与菜单的 print / input 保持先后顺序）；
+    文件日志先放入队列，由后台线程写入，避免磁盘 I/O 阻塞备份流程
     """
+    global _listener
+    
     # 创建日志目录
     log_dir = Path(__file__).parent / 'logs'
     log_dir.mkdir(exist_ok=True)
@@ -29,14 +51,14 @@ def setup_logger(log_level=logging.INFO):
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
     
-    # 清除现有的处理器（避免重复）
+    # 清除现有的处理器和监听线程（避免重复）
     root_logger.handlers.clear()
+    _stop_listener()
     
     # 控制台处理器
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(log_level)
     console_handler.setFormatter(formatter)
-    root_logger.addHandler(console_handler)
     
     # 文件处理器（带轮转）
     log_file = log_dir / 'backup.log'
@@ -48,7 +70,15 @@ def setup_logger(log_level=logging.INFO):
     )
     file_handler.setLevel(log_level)
     file_handler.setFormatter(formatter)
-    root_logger.addHandler(file_handler)
+    
+    # 控制台直接挂在根日志器上：日志与菜单的 print 输出按调用顺序出现
+    root_logger.addHandler(console_handler)
+    
+    # 队列处理器：QueueHandler.prepare 在调用日志的线程中完成格式化，监听线程只负责写入文件
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    root_logger.addHandler(QueueHandler(log_queue))
     
     # 抑制 Git 库的过多日志
     logging.getLogger('git').setLevel(logging.WARNING)
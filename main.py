@@ -17,6 +17,50 @@ from logger import setup_logger
 logger = logging.getLogger(__name__)
 
 
+def watch_and_backup(backup_manager: BackupManager, config: dict) -> bool:
+    """
+    监听数据目录，文件变化停止一段时间后触发备份（trigger_mode=inotify）
+    Linux 上使用 inotify，其他系统使用各自的原生文件事件接口
+    
+    返回 False 表示当前环境无法使用文件监听，调用方应回退到定时备份
+    """
+    try:
+        from watchfiles import DefaultFilter, watch
+    except ImportError:
+        logger.warning("未安装 watchfiles，无法使用文件监听触发，回退到定时备份")
+        return False
+    
+    debounce = config.get('watch_debounce_seconds', 30)
+    # 与同步时跳过的目录保持一致，缓存、日志等目录的变化不触发备份
+    watch_filter = DefaultFilter(ignore_dirs=backup_manager.skip_dirs)
+    
+    logger.info(f"文件监听已启用: {backup_manager.data_path}")
+    logger.info(f"文件变化停止 {debounce} 秒后自动备份")
+    logger.info("守护进程正在运行，按 Ctrl+C 停止...")
+    logger.info("-" * 60)
+    
+    pending = 0
+    # 超时未收到新事件时会产出空集合，用来判断“变化已停止”
+    # NFS 等网络文件系统收不到文件事件，可设置 watch_force_polling 改为轮询
+    for changes in watch(
+        backup_manager.data_path,
+        watch_filter=watch_filter,
+        rust_timeout=debounce * 1000,
+        yield_on_timeout=True,
+        force_polling=config.get('watch_force_polling'),
+    ):
+        if changes:
+            pending += len(changes)
+            continue
+        
+        if pending:
+            logger.info(f"检测到 {pending} 处文件变化，开始备份")
+            pending = 0
+            backup_manager.run_backup(background_push=True)
+    
+    return True
+
+
 def main():
     """主函数"""
     setup_logger()
@@ -42,6 +86,14 @@ def main():
             logger.info("  恢复: python restore.py")
             return 0
         
+        # 创建备份管理器
+        backup_manager = BackupManager(config)
+        
+        # 文件监听模式：数据有变化时才备份
+        if config['trigger_mode'] == 'inotify':
+            if watch_and_backup(backup_manager, config):
+                return 0
+        
         # 解析备份时间
         hour, minute = config['backup_time'].split(':')
         hour, minute = int(hour), int(minute)
@@ -50,9 +102,6 @@ def main():
         logger.info("守护进程正在运行，按 Ctrl+C 停止...")
         logger.info("-" * 60)
         
-        # 创建备份管理器
-        backup_manager = BackupManager(config)
-        
         # 创建调度器
         scheduler = BlockingScheduler()
         
@@ -61,10 +110,19 @@ def main():
         scheduler.add_job(
             backup_manager.run_backup,
             trigger=trigger,
+            kwargs={'background_push': True},
             id='auto_backup',
             name='自动备份任务'
         )
         
+        # 每周日 04:00 完整重新打包备份仓库
+        scheduler.add_job(
+            backup_manager.repack_repo,
+            trigger=CronTrigger(day_of_week='sun', hour=4),
+            id='weekly_repack',
+            name='仓库整理任务'
+        )
+        
         # 启动调度器（阻塞运行）
         scheduler.start()
         
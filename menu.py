@@ -5,56 +5,248 @@
 提供简单的命令行界面进行备份和恢复操作
 """
 
+import heapq
 import sys
 from pathlib import Path
 
-from config import load_config, validate_config
-from backup import BackupManager
-from restore import RestoreManager
+from config import IS_DOCKER, load_config, validate_config
 from logger import setup_logger
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 备份列表中的时间格式
+_TS_FMT = '%Y-%m-%d %H:%M:%S'
+
+# 分隔线（导入时生成一次）
+_SEP60 = "=" * 60
+_SEP80 = "=" * 80
+_DASH60 = "-" * 60
+_DASH80 = "-" * 80
+
+# 主菜单（固定文本，导入时拼好）
+_MENU_TEXT = """
+============================================================
+       SillyTavern 云备份工具 - 快捷操作菜单
+============================================================
+
+  📦 备份操作
+    1. 执行手动备份
+    2. 列出并拉取备份版本
+
+  🛠️  存档管理
+    3. 修改存档描述
+    4. 删除云端存档
+    5. 比较存档差异
+
+  ❌ 退出
+    0. 退出程序
+
+"""
+
+# 拉取备份后的操作说明（{export_dir} 为导出目录）
+_EXPORT_HELP = """
+============================================================
+✅ 备份已拉取到容器内路径：{export_dir}/data/
+
+⚠️  接下来请手动操作：
+   1. 停止 SillyTavern 服务
+   2. 备份当前 SillyTavern/data 目录（可选）
+   3. 复制 {export_dir}/data/ 的内容
+      到 SillyTavern/data/
+   4. 重启 SillyTavern 服务
+
+命令示例：
+  # 备份当前数据（可选）
+  mv <ST-path>/data <ST-path>/data.backup
+
+  # 复制恢复的数据（在宿主机上执行）
+""" + (
+    "  docker cp sillytavern-backup:{export_dir}/data <ST-path>/\n"
+    if IS_DOCKER else
+    "  cp -r {export_dir}/data <ST-path>/\n"
+) + _SEP60 + "\n"
+
+# 标准输入不是终端（脚本驱动、管道输入）时跳过“按回车键继续”的暂停
+_INTERACTIVE = sys.stdin is not None and sys.stdin.isatty()
+
+# 以 --yes 启动时自动确认 y/n 提示（删除存档仍需手动输入 DELETE）
+_ASSUME_YES = False
+
+# 备份列表缓存：(HEAD 提交, 数量) -> list_backups 的结果
+# 菜单各项反复进入时，HEAD 没有变化就不再重新遍历提交历史
+_backup_cache = {}
+
+
+# 会话内共享的管理器实例（首次使用时创建，Git 仓库只打开一次）
+# backup / restore 模块会引入 GitPython，在第一次用到时才导入，菜单可以更快显示
+_managers = {}
+
+
+def _get_backup_manager(config):
+    """获取共享的备份管理器"""
+    manager = _managers.get('backup')
+    if manager is None:
+        from backup import BackupManager
+        
+        manager = BackupManager(config)
+        _managers['backup'] = manager
+    return manager
+
+
+def _get_restore_manager(config):
+    """获取共享的恢复管理器，首次调用时初始化仓库；失败返回 None"""
+    manager = _managers.get('restore')
+    if manager is None:
+        from restore import RestoreManager
+        
+        manager = RestoreManager(config)
+        
+        # 两个管理器共用同一个 Repo 对象：谁先打开仓库，另一个就直接沿用
+        backup_manager = _get_backup_manager(config)
+        manager.repo = backup_manager.repo
+        if not manager.init_repo():
+            return None
+        _managers['restore'] = manager
+        
+        if backup_manager.repo is None:
+            backup_manager.repo = manager.repo
+    return manager
+
+
+def _cached_list_backups(manager, max_count=20):
+    """列出备份版本（HEAD 未变化时直接返回缓存结果）"""
+    try:
+        head = manager.repo.head.commit.hexsha
+    except ValueError:
+        # 仓库中还没有任何提交
+        return []
+    
+    key = (head, max_count)
+    backups = _backup_cache.get(key)
+    if backups is None:
+        backups = manager.list_backups(max_count=max_count)
+        if backups:
+            # 只保留最新 HEAD 对应的一份结果，旧 HEAD 的列表不会再被用到
+            _backup_cache.clear()
+            _backup_cache[key] = backups
+    return backups
+
+
+# 备份列表的渲染结果：(表头, 是否显示详情) -> (备份列表, 文本)
+# 备份列表本身按 HEAD 缓存，同一个列表对象再次显示时直接写出上次拼好的文本
+_table_cache = {}
+
+
+def _show_backup_table(backups, header="描述", details=False):
+    """显示备份列表（details=True 时在每行下方列出变更摘要）"""
+    key = (header, details)
+    cached = _table_cache.get(key)
+    if cached is not None and cached[0] is backups:
+        sys.stdout.write(cached[1])
+        sys.stdout.flush()
+        return
+    
+    buf = ["", f"序号  提交哈希   时间                    {header}", _DASH80]
+    for i, entry in enumerate(backups, 1):
+        # 只显示第一行（时间戳），第一行在 list_backups 中已经取好
+        buf.append(f"{i:2d}.   {entry.sha}    {entry.dt.strftime(_TS_FMT)}  {entry.first_line}")
+        
+        # 如果有详细信息，显示变更摘要（缩进）
+        if details:
+            rest = entry.msg[len(entry.first_line) + 1:]
+            # 自动生成的描述在第一行后紧跟空行，剩余部分即为摘要，无需再次查找
+            tail = rest[1:] if rest.startswith('\n') else rest.partition('\n\n')[2]
+            if tail:
+                for detail in tail.split('\n\n'):
+                    detail = detail.strip()
+                    if detail:
+                        buf.append(f"       → {detail}")
+            buf.append("")  # 空行分隔
+    buf.append(_DASH80 if details else "")
+    
+    text = '\n'.join(buf) + '\n'
+    _table_cache[key] = (backups, text)
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def _write_lines(lines):
+    """一次写出多行文本（整块输出只需一次 write 调用）"""
+    sys.stdout.write('\n'.join(lines) + '\n')
+    sys.stdout.flush()
+
+
+def _pause():
+    """等待用户按回车键继续（非交互运行时直接返回）"""
+    if _INTERACTIVE:
+        input("按回车键继续...")
+
+
+def _confirm(prompt):
+    """询问 y/n，输入 y 返回 True；以 --yes 启动时直接确认"""
+    if _ASSUME_YES:
+        print(f"{prompt}y")
+        return True
+    return input(prompt).strip().lower() == 'y'
+
+
+def _ask_index(prompt, count, exclude=None):
+    """
+    循环询问备份序号，返回从 0 开始的下标；输入 'q' 返回 None
+    exclude 为不允许再次选择的下标（比较两个版本时使用）
+    """
+    while True:
+        choice = input(prompt).strip()
+        if choice.lower() == 'q':
+            return None
+        
+        # 先用 isdecimal 判断，非数字输入不必经过 int() 抛出异常
+        if not choice.isdecimal():
+            print("❌ 请输入数字")
+            continue
+        
+        index = int(choice) - 1
+        if not 0 <= index < count:
+            print("❌ 无效的序号")
+        elif index == exclude:
+            print("❌ 不能选择相同的版本")
+        else:
+            return index
+
+
+def _write_header(title, *extra):
+    """输出操作标题（以及紧随其后的固定说明行），整块一次写出"""
+    _write_lines(["", _DASH60, title, _DASH60, *extra])
+
+
+def _show_description(msg, label="描述"):
+    """显示提交描述的第一行，多行描述由用户按需展开"""
+    first_line, _, rest = msg.partition('\n')
+    print(f"{label}: {first_line}")
+    if rest.strip():
+        more = rest.count('\n') + 1
+        choice = input(f"      (+{more} 更多行，输入 'v' 查看，直接回车继续): ").strip().lower()
+        if choice == 'v':
+            _write_lines([_DASH60, msg, _DASH60])
+
 
 def show_menu():
     """显示主菜单"""
-    print()
-    print("=" * 60)
-    print("       SillyTavern 云备份工具 - 快捷操作菜单")
-    print("=" * 60)
-    print()
-    print("  📦 备份操作")
-    print("    1. 执行手动备份")
-    print("    2. 列出并拉取备份版本")
-    print()
-    print("  🛠️  存档管理")
-    print("    3. 修改存档描述")
-    print("    4. 删除云端存档")
-    print("    5. 比较存档差异")
-    print()
-    print("  ❌ 退出")
-    print("    0. 退出程序")
-    print()
+    sys.stdout.write(_MENU_TEXT)
+    sys.stdout.flush()
 
 
 def manual_backup(config):
     """执行手动备份"""
-    print()
-    print("-" * 60)
-    print("手动备份")
-    print("-" * 60)
-    print()
+    _write_header("手动备份", "")
     
     # 询问是否自定义描述
     use_custom = input("是否自定义备份描述？(y/n，默认n): ").strip().lower()
     
     custom_message = None
     if use_custom == 'y':
-        print()
-        print("请输入备份描述（可多行，输入空行结束）：")
-        print("提示：可以写明备份原因、重要内容等")
-        print()
+        _write_lines(["", "请输入备份描述（可多行，输入空行结束）：", "提示：可以写明备份原因、重要内容等", ""])
         
         lines = []
         while True:
@@ -65,202 +257,111 @@ def manual_backup(config):
         
         if lines:
             custom_message = '\n'.join(lines)
-            print()
-            print("您的备份描述：")
-            print("-" * 60)
-            print(custom_message)
-            print("-" * 60)
-            print()
+            _write_lines(["", "您的备份描述：", _DASH60, custom_message, _DASH60, ""])
             
-            confirm = input("确认使用此描述？(y/n): ").strip().lower()
-            if confirm != 'y':
+            if not _confirm("确认使用此描述？(y/n): "):
                 print("已取消自定义描述，将使用自动生成的描述")
                 custom_message = None
         else:
             print("描述为空，将使用自动生成的描述")
     
-    print()
-    print("开始备份...")
-    print("-" * 60)
+    _write_lines(["", "开始备份...", _DASH60])
     
-    manager = BackupManager(config)
+    manager = _get_backup_manager(config)
     success = manager.run_backup(custom_message)
     
     if success:
+        _backup_cache.clear()
         print()
         print("✅ 备份成功！")
         if custom_message:
-            print(f"📝 备份描述: {custom_message.split(chr(10))[0]}")
+            first_line = custom_message.partition('\n')[0]
+            print(f"📝 备份描述: {first_line}")
         print()
     else:
         print()
         print("❌ 备份失败，请查看日志")
         print()
     
-    input("按回车键继续...")
+    _pause()
 
 
 def list_and_restore(config):
     """列出备份版本并拉取"""
-    print()
-    print("-" * 60)
-    print("备份版本列表")
-    print("-" * 60)
-    
-    manager = RestoreManager(config)
+    _write_header("备份版本列表")
     
-    # 初始化仓库
-    if not manager.init_repo():
+    # 初始化仓库（会话内只打开一次）
+    manager = _get_restore_manager(config)
+    if manager is None:
         print("❌ 无法连接到备份仓库")
-        input("按回车键继续...")
+        _pause()
         return
     
     # 列出备份
-    backups = manager.list_backups(max_count=20)
+    backups = _cached_list_backups(manager)
     if not backups:
         print("❌ 没有可用的备份")
-        input("按回车键继续...")
+        _pause()
         return
     
-    print()
-    print("序号  提交哈希   时间                    描述")
-    print("-" * 80)
-    for i, (hash_val, msg, dt) in enumerate(backups, 1):
-        # 只显示第一行（时间戳）
-        first_line = msg.split('\n')[0]
-        print(f"{i:2d}.   {hash_val}    {dt.strftime('%Y-%m-%d %H:%M:%S')}  {first_line}")
-        
-        # 如果有详细信息，显示在下一行
-        if '\n' in msg:
-            details = msg.split('\n\n')
-            if len(details) > 1:
-                # 显示变更摘要（缩进）
-                for detail in details[1:]:
-                    if detail.strip():
-                        print(f"       → {detail.strip()}")
-        print()  # 空行分隔
-    print("-" * 80)
+    _show_backup_table(backups, details=True)
     
     # 选择版本
-    while True:
-        choice = input("请选择要拉取的版本（输入序号，或 'q' 取消）: ").strip()
-        if choice.lower() == 'q':
-            return
-        
-        try:
-            index = int(choice) - 1
-            if 0 <= index < len(backups):
-                break
-            else:
-                print("❌ 无效的序号，请重新输入")
-        except ValueError:
-            print("❌ 请输入数字")
+    index = _ask_index("请选择要拉取的版本（输入序号，或 'q' 取消）: ", len(backups))
+    if index is None:
+        return
     
-    selected_hash = backups[index][0]
-    selected_msg = backups[index][1]
-    selected_time = backups[index][2]
+    selected_hash = backups[index].sha
+    selected_msg = backups[index].msg
+    selected_time = backups[index].dt
     
     print()
-    print(f"您选择的版本: {selected_hash} - {selected_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    print(f"描述: {selected_msg}")
+    print(f"您选择的版本: {selected_hash} - {selected_time.strftime(_TS_FMT)}")
+    _show_description(selected_msg)
     print()
     
-    # 拉取到本地
-    print("正在拉取备份到 /backup/data/ ...")
-    try:
-        # 检出指定版本
-        manager.repo.git.checkout(selected_hash)
-        
-        # 检查 data 目录是否存在
-        backup_data_path = manager.repo_path / 'data'
-        if backup_data_path.exists():
-            print()
-            print("=" * 60)
-            print("✅ 备份已拉取到容器内路径：/backup/data/")
-            print()
-            print("📂 在宿主机上的位置：<backup-repo>/data/")
-            print()
-            print("⚠️  接下来请手动操作：")
-            print("   1. 停止 SillyTavern 服务")
-            print("   2. 备份当前 SillyTavern/data 目录（可选）")
-            print("   3. 复制 <backup-repo>/data/ 的内容")
-            print("      到 SillyTavern/data/")
-            print("   4. 重启 SillyTavern 服务")
-            print()
-            print("命令示例：")
-            print("  # 备份当前数据（可选）")
-            print("  mv <ST-path>/data <ST-path>/data.backup")
-            print()
-            print("  # 复制恢复的数据")
-            print("  cp -r <backup-repo>/data <ST-path>/")
-            print("=" * 60)
-        else:
-            print()
-            print("❌ 备份中未找到 data 目录，可能是旧版本备份")
-            print("   备份内容在：<backup-repo>/")
-        
-        # 返回到最新版本
-        manager.repo.git.checkout('HEAD')
-        
-    except Exception as e:
-        print(f"❌ 拉取失败: {e}")
+    # 导出到临时目录（不检出版本，备份仓库保持在最新提交）
+    export_dir = Path(f"/tmp/st-restore-{selected_hash}")
+    print(f"正在拉取备份到 {export_dir}/data/ ...")
+    if manager.export_version(selected_hash, export_dir):
+        sys.stdout.write(_EXPORT_HELP.format(export_dir=export_dir))
+        sys.stdout.flush()
+    else:
+        print("❌ 拉取失败，请查看日志")
     
     print()
-    input("按回车键继续...")
+    _pause()
 
 
 def edit_commit_message(config):
     """修改存档描述"""
-    print()
-    print("-" * 60)
-    print("修改存档描述")
-    print("-" * 60)
-    
-    manager = RestoreManager(config)
+    _write_header("修改存档描述")
     
-    if not manager.init_repo():
+    manager = _get_restore_manager(config)
+    if manager is None:
         print("❌ 无法连接到备份仓库")
-        input("按回车键继续...")
+        _pause()
         return
     
-    backups = manager.list_backups(max_count=20)
+    backups = _cached_list_backups(manager)
     if not backups:
         print("❌ 没有可用的备份")
-        input("按回车键继续...")
+        _pause()
         return
     
     # 显示列表
-    print()
-    print("序号  提交哈希   时间                    当前描述")
-    print("-" * 80)
-    for i, (hash_val, msg, dt) in enumerate(backups, 1):
-        first_line = msg.split('\n')[0]
-        print(f"{i:2d}.   {hash_val}    {dt.strftime('%Y-%m-%d %H:%M:%S')}  {first_line}")
-    print()
+    _show_backup_table(backups, header="当前描述")
     
     # 选择要编辑的版本
-    while True:
-        choice = input("请选择要修改的版本（输入序号，或 'q' 取消）: ").strip()
-        if choice.lower() == 'q':
-            return
-        
-        try:
-            index = int(choice) - 1
-            if 0 <= index < len(backups):
-                break
-            else:
-                print("❌ 无效的序号")
-        except ValueError:
-            print("❌ 请输入数字")
+    index = _ask_index("请选择要修改的版本（输入序号，或 'q' 取消）: ", len(backups))
+    if index is None:
+        return
     
-    selected_hash = backups[index][0]
-    old_msg = backups[index][1]
+    selected_hash = backups[index].sha
+    old_msg = backups[index].msg
     
     print()
-    print(f"当前完整描述：")
-    print("-" * 60)
-    print(old_msg)
-    print("-" * 60)
+    _show_description(old_msg, "当前描述")
     print()
     
     # 输入新描述
@@ -274,113 +375,92 @@ def edit_commit_message(config):
     
     if not new_lines:
         print("❌ 描述不能为空")
-        input("按回车键继续...")
+        _pause()
         return
     
     new_msg = '\n'.join(new_lines)
     
     # 确认修改
-    print()
-    print("新的描述：")
-    print("-" * 60)
-    print(new_msg)
-    print("-" * 60)
-    print()
+    _write_lines(["", "新的描述：", _DASH60, new_msg, _DASH60, ""])
     
-    confirm = input("确认修改？(y/n): ").strip().lower()
-    if confirm != 'y':
+    if not _confirm("确认修改？(y/n): "):
         print("已取消")
-        input("按回车键继续...")
+        _pause()
         return
     
     try:
-        # 使用 git commit --amend 修改最近的提交（如果是最新的）
-        # 或使用 git rebase -i 修改历史提交
+        # 最新的提交使用 git commit --amend 修改
+        # 历史提交使用 git rebase -i 修改
         current_branch = manager.repo.active_branch.name
         
         if index == 0:
-            # 最新的提交，可以直接 amend
-            manager.repo.git.commit('--amend', '-m', new_msg)
+            # 最新的提交，可以直接 amend（--only：只改描述，不提交暂存区中的内容）
+            manager.repo.git.commit('--amend', '--only', '-m', new_msg)
+            _backup_cache.clear()
             print("✅ 描述已更新")
             
             # 强制推送到远程
             print("正在推送到远程...")
-            manager.repo.git.push('origin', current_branch, '--force')
+            manager.repo.git.push('origin', current_branch, '--force-with-lease')
             print("✅ 已同步到云端")
         else:
             print()
             print("⚠️  修改历史提交需要重写 Git 历史")
             print("   这会影响所有后续提交，建议谨慎操作")
             print()
-            confirm2 = input("确认继续？(y/n): ").strip().lower()
-            if confirm2 != 'y':
+            if not _confirm("确认继续？(y/n): "):
                 print("已取消")
-                input("按回车键继续...")
+                _pause()
                 return
             
-            # 使用 filter-branch 或 rebase -i（这里简化处理）
-            print("❌ 暂不支持修改历史提交，请联系开发者")
-            print("   建议：删除旧存档，重新创建")
+            if manager.modify_commit_message(selected_hash, new_msg):
+                _backup_cache.clear()
+                print("✅ 描述已更新")
+                
+                # 强制推送到远程
+                print("正在推送到远程...")
+                manager.repo.git.push('origin', current_branch, '--force-with-lease')
+                print("✅ 已同步到云端")
+            else:
+                print("❌ 修改失败，请查看日志")
     
     except Exception as e:
+        logger.exception(f"修改存档描述失败: {selected_hash}")
         print(f"❌ 修改失败: {e}")
     
     print()
-    input("按回车键继续...")
+    _pause()
 
 
 def delete_backup(config):
     """删除云端存档"""
-    print()
-    print("-" * 60)
-    print("删除云端存档")
-    print("-" * 60)
-    print()
-    print("⚠️  警告：此操作将永久删除选定的备份！")
-    print()
-    
-    manager = RestoreManager(config)
+    _write_header("删除云端存档", "", "⚠️  警告：此操作将永久删除选定的备份！", "")
     
-    if not manager.init_repo():
+    manager = _get_restore_manager(config)
+    if manager is None:
         print("❌ 无法连接到备份仓库")
-        input("按回车键继续...")
+        _pause()
         return
     
-    backups = manager.list_backups(max_count=20)
+    backups = _cached_list_backups(manager)
     if not backups:
         print("❌ 没有可用的备份")
-        input("按回车键继续...")
+        _pause()
         return
     
-    print()
-    print("序号  提交哈希   时间                    描述")
-    print("-" * 80)
-    for i, (hash_val, msg, dt) in enumerate(backups, 1):
-        first_line = msg.split('\n')[0]
-        print(f"{i:2d}.   {hash_val}    {dt.strftime('%Y-%m-%d %H:%M:%S')}  {first_line}")
-    print()
+    _show_backup_table(backups)
     
     # 选择要删除的版本
-    while True:
-        choice = input("请选择要删除的版本（输入序号，或 'q' 取消）: ").strip()
-        if choice.lower() == 'q':
-            return
-        
-        try:
-            index = int(choice) - 1
-            if 0 <= index < len(backups):
-                break
-            else:
-                print("❌ 无效的序号")
-        except ValueError:
-            print("❌ 请输入数字")
+    index = _ask_index("请选择要删除的版本（输入序号，或 'q' 取消）: ", len(backups))
+    if index is None:
+        return
     
-    selected_hash = backups[index][0]
-    selected_msg = backups[index][1]
+    selected_hash = backups[index].sha
+    selected_first_line = backups[index].first_line
     
     print()
     print(f"将要删除: {selected_hash}")
-    print(f"描述: {selected_msg.split(chr(10))[0]}")
+    print(f"描述: {selected_first_line}")
     print()
     print("⚠️  此操作不可逆！")
     print()
@@ -388,43 +468,53 @@ def delete_backup(config):
     confirm = input("确认删除？请输入 'DELETE' 确认: ").strip()
     if confirm != 'DELETE':
         print("已取消")
-        input("按回车键继续...")
+        _pause()
         return
     
     try:
         # 删除提交（使用 git rebase）
         if index == 0:
-            # 删除最新提交
-            manager.repo.git.reset('--hard', 'HEAD~1')
+            # 删除最新提交：只把分支指回上一个提交，不改写工作区
+            # （工作区在下次备份同步时会被覆盖，无需 reset --hard 逐个重写文件）
+            # 带上当前提交作为旧值，期间若有新的备份提交则拒绝更新
+            current_branch = manager.repo.active_branch.name
+            head = manager.repo.head.commit
+            manager.repo.git.update_ref(
+                '-m', f'删除备份 {selected_hash}',
+                f'refs/heads/{current_branch}', f'{head.hexsha}~1', head.hexsha
+            )
+            # 索引同步到新的 HEAD（只重置索引，不改写工作区），
+            # 否则暂存区仍是被删除提交的内容，之后的 amend / rebase 会把它带回来
+            manager.repo.git.read_tree('HEAD')
+            _backup_cache.clear()
             print("✅ 本地提交已删除")
             
             # 强制推送
             print("正在同步到云端...")
-            current_branch = manager.repo.active_branch.name
-            manager.repo.git.push('origin', current_branch, '--force')
+            manager.repo.git.push('origin', current_branch, '--force-with-lease')
             print("✅ 云端存档已删除")
         else:
             print("❌ 暂不支持删除历史提交")
             print("   如需删除，请使用 git rebase -i")
     
     except Exception as e:
+        logger.exception(f"删除存档失败: {selected_hash}")
         print(f"❌ 删除失败: {e}")
     
     print()
-    input("按回车键继续...")
+    _pause()
 
 
 def compare_diff(config):
     """比较存档与当前数据的差异"""
-    print()
-    print("-" * 60)
-    print("比较存档差异")
-    print("-" * 60)
-    print()
-    print("请选择比较模式：")
-    print("  1. 历史备份 vs 当前数据")
-    print("  2. 历史备份 vs 另一个历史备份")
-    print()
+    _write_header(
+        "比较存档差异",
+        "",
+        "请选择比较模式：",
+        "  1. 历史备份 vs 当前数据",
+        "  2. 历史备份 vs 另一个历史备份",
+        "",
+    )
     
     mode = input("选择模式 (1/2，或 'q' 取消): ").strip()
     if mode == 'q':
@@ -432,51 +522,38 @@ def compare_diff(config):
     
     if mode not in ['1', '2']:
         print("❌ 无效的选择")
-        input("按回车键继续...")
+        _pause()
         return
     
-    manager = RestoreManager(config)
-    backup_manager = BackupManager(config)
+    manager = _get_restore_manager(config)
+    backup_manager = _get_backup_manager(config)
     
-    if not manager.init_repo():
+    if manager is None:
         print("❌ 无法连接到备份仓库")
-        input("按回车键继续...")
+        _pause()
         return
     
-    backups = manager.list_backups(max_count=20)
+    backups = _cached_list_backups(manager)
     if not backups:
         print("❌ 没有可用的备份")
-        input("按回车键继续...")
+        _pause()
         return
     
-    # 显示备份列表
-    def show_backup_list():
-        print()
-        print("序号  提交哈希   时间                    描述")
-        print("-" * 80)
-        for i, (hash_val, msg, dt) in enumerate(backups, 1):
-            first_line = msg.split('\n')[0]
-            print(f"{i:2d}.   {hash_val}    {dt.strftime('%Y-%m-%d %H:%M:%S')}  {first_line}")
-        print()
-    
     # 选择第一个备份
-    show_backup_list()
-    while True:
-        choice = input("请选择要比较的版本（输入序号，或 'q' 取消）: ").strip()
-        if choice.lower() == 'q':
-            return
-        
-        try:
-            index1 = int(choice) - 1
-            if 0 <= index1 < len(backups):
-                break
-            else:
-                print("❌ 无效的序号")
-        except ValueError:
-            print("❌ 请输入数字")
+    _show_backup_table(backups)
     
-    selected_hash1 = backups[index1][0]
-    selected_msg1 = backups[index1][1].split('\n')[0]
+    # 用户选择期间在后台预先为本地文件计算哈希（可通过 MENU_PREFETCH=false 关闭）
+    if mode == '1' and config.get('menu_prefetch', True):
+        backup_manager.prefetch_compare_index()
+    
+    index1 = _ask_index("请选择要比较的版本（输入序号，或 'q' 取消）: ", len(backups))
+    if index1 is None:
+        # 取消时等预热结束再返回，避免它与之后的比较同时写比较索引
+        backup_manager.wait_prefetch()
+        return
+    
+    selected_hash1 = backups[index1].sha
+    selected_msg1 = backups[index1].first_line
     
     # 如果是模式2，选择第二个备份
     selected_hash2 = None
@@ -485,411 +562,170 @@ def compare_diff(config):
         print()
         print(f"已选择第一个版本: {selected_hash1} - {selected_msg1}")
         print()
-        show_backup_list()
+        _show_backup_table(backups)
         
-        while True:
-            choice = input("请选择第二个版本（输入序号，或 'q' 取消）: ").strip()
-            if choice.lower() == 'q':
-                return
-            
-            try:
-                index2 = int(choice) - 1
-                if 0 <= index2 < len(backups):
-                    if index2 == index1:
-                        print("❌ 不能选择相同的版本")
-                        continue
-                    break
-                else:
-                    print("❌ 无效的序号")
-            except ValueError:
-                print("❌ 请输入数字")
+        index2 = _ask_index("请选择第二个版本（输入序号，或 'q' 取消）: ", len(backups), exclude=index1)
+        if index2 is None:
+            return
         
-        selected_hash2 = backups[index2][0]
-        selected_msg2 = backups[index2][1].split('\n')[0]
+        selected_hash2 = backups[index2].sha
+        selected_msg2 = backups[index2].first_line
     
     print()
     print("正在分析差异...")
     
     try:
         if mode == '1':
-            # 模式1: 备份 vs 当前数据
-            manager.repo.git.checkout(selected_hash1)
-            
-            backup_data = manager.repo_path / 'data'
-            current_data = backup_manager.data_path
-            
-            if not backup_data.exists():
-                print("❌ 备份中未找到 data 目录")
-                manager.repo.git.checkout('HEAD')
-                input("按回车键继续...")
-                return
-            
-            # 收集文件列表
-            backup_files = {}
-            current_files = {}
-            
-            for item in backup_data.rglob('*'):
-                if item.is_file():
-                    rel_path = str(item.relative_to(backup_data))
-                    backup_files[rel_path] = item.stat().st_size
-            
-            for item in current_data.rglob('*'):
-                if item.is_file():
-                    rel_path = str(item.relative_to(current_data))
-                    current_files[rel_path] = item.stat().st_size
+            # 模式1: 备份 vs 当前数据（由 git 直接比较，无需检出备份）
+            added, changed, removed = backup_manager.compare_with_local(selected_hash1)
             
             label_a = f"备份 {selected_hash1}"
             label_b = "当前数据"
-            files_a = backup_files
-            files_b = current_files
+            only_in_a = set(removed)
+            only_in_b = set(added)
+            modified_files = [
+                (rel_path, size_a, size_b, size_b - size_a)
+                for rel_path, size_a, size_b in changed
+            ]
         
         else:
-            # 模式2: 备份 vs 备份
-            manager.repo.git.checkout(selected_hash1)
-            backup_data1 = manager.repo_path / 'data'
-            
-            if not backup_data1.exists():
-                print("❌ 第一个备份中未找到 data 目录")
-                manager.repo.git.checkout('HEAD')
-                input("按回车键继续...")
-                return
-            
-            # 收集第一个备份的文件
-            backup1_files = {}
-            for item in backup_data1.rglob('*'):
-                if item.is_file():
-                    rel_path = str(item.relative_to(backup_data1))
-                    backup1_files[rel_path] = item.stat().st_size
-            
-            # 切换到第二个备份
-            manager.repo.git.checkout(selected_hash2)
-            backup_data2 = manager.repo_path / 'data'
-            
-            if not backup_data2.exists():
-                print("❌ 第二个备份中未找到 data 目录")
-                manager.repo.git.checkout('HEAD')
-                input("按回车键继续...")
-                return
-            
-            # 收集第二个备份的文件
-            backup2_files = {}
-            for item in backup_data2.rglob('*'):
-                if item.is_file():
-                    rel_path = str(item.relative_to(backup_data2))
-                    backup2_files[rel_path] = item.stat().st_size
+            # 模式2: 备份 vs 备份（由 git 直接比较两棵提交树，无需检出）
+            added, changed, removed = backup_manager.compare_commits(
+                selected_hash1, selected_hash2
+            )
             
             label_a = f"备份 {selected_hash1}"
             label_b = f"备份 {selected_hash2}"
-            files_a = backup1_files
-            files_b = backup2_files
-        
-        # 分析差异
-        only_in_a = set(files_a.keys()) - set(files_b.keys())
-        only_in_b = set(files_b.keys()) - set(files_a.keys())
-        common_files = set(files_a.keys()) & set(files_b.keys())
-        
-        # 检查共同文件的修改
-        modified_files = []
-        for rel_path in common_files:
-            if files_a[rel_path] != files_b[rel_path]:
-                size_diff = files_b[rel_path] - files_a[rel_path]
-                modified_files.append((rel_path, files_a[rel_path], files_b[rel_path], size_diff))
+            only_in_a = set(removed)
+            only_in_b = set(added)
+            modified_files = [
+                (rel_path, size_a, size_b, size_b - size_a)
+                for rel_path, size_a, size_b in changed
+            ]
         
         # 分类文件（聊天、角色、配置等）
-        def categorize_files(file_list):
+        def categorize_files(paths, items=None):
+            """
+            按路径分类；items 与 paths 一一对应时把对应条目放入分组
+            （已修改的条目为 (路径, 大小A, 大小B, 差值)），否则直接放入路径
+            """
             chats = []
             characters = []
             configs = []
             others = []
             
-            for f in file_list:
-                if isinstance(f, tuple):
-                    f = f[0]
-                if 'chats/' in f or 'chat' in f.lower():
-                    chats.append(f)
-                elif 'characters/' in f or 'character' in f.lower():
-                    characters.append(f)
-                elif any(x in f.lower() for x in ['settings', 'config', 'preset']):
-                    configs.append(f)
+            for f, item in zip(paths, paths if items is None else items):
+                # 每个路径只转换一次小写（'chats/' 等目录名同样由小写匹配覆盖）
+                lower = f.lower()
+                if 'chat' in lower:
+                    chats.append(item)
+                elif 'character' in lower:
+                    characters.append(item)
+                elif 'settings' in lower or 'config' in lower or 'preset' in lower:
+                    configs.append(item)
                 else:
-                    others.append(f)
+                    others.append(item)
             
             return chats, characters, configs, others
         
-        # 显示结果
-        print()
-        print("=" * 80)
-        print(f"差异分析结果：{label_a} ⟷ {label_b}")
-        print("=" * 80)
+        # 文件预览：按路径排序后最多显示 limit 个，其余汇总为一行
+        def preview(files, marker, limit=None):
+            if limit is None:
+                shown = sorted(files)
+            else:
+                # 只取排在最前的 limit 个，不必对整个列表排序
+                shown = heapq.nsmallest(limit, files)
+            lines = [f"      {marker} {f}" for f in shown]
+            if limit is not None and len(files) > limit:
+                lines.append(f"      ... 还有 {len(files) - limit} 个")
+            return lines
         
-        # 仅在 A 中的文件
-        if only_in_a:
-            chats, chars, configs, others = categorize_files(only_in_a)
-            print()
-            print(f"📂 仅在 {label_a} 中存在 (共 {len(only_in_a)} 个)：")
-            
-            if chats:
-                print(f"   💬 聊天记录 ({len(chats)} 个):")
-                for f in sorted(chats)[:5]:
-                    print(f"      - {f}")
-                if len(chats) > 5:
-                    print(f"      ... 还有 {len(chats) - 5} 个")
-            
-            if chars:
-                print(f"   👤 角色卡 ({len(chars)} 个):")
-                for f in sorted(chars)[:3]:
-                    print(f"      - {f}")
-                if len(chars) > 3:
-                    print(f"      ... 还有 {len(chars) - 3} 个")
-            
-            if configs:
-                print(f"   ⚙️ 配置文件 ({len(configs)} 个):")
-                for f in sorted(configs):
-                    print(f"      - {f}")
-            
-            if others and len(others) <= 5:
-                print(f"   📄 其他文件:")
-                for f in sorted(others):
-                    print(f"      - {f}")
+        # 显示结果（整份报告拼好后一次输出）
+        buf = ["", _SEP80, f"差异分析结果：{label_a} ⟷ {label_b}", _SEP80]
         
-        # 仅在 B 中的文件
-        if only_in_b:
-            chats, chars, configs, others = categorize_files(only_in_b)
-            print()
-            print(f"📂 仅在 {label_b} 中存在 (共 {len(only_in_b)} 个)：")
+        # 仅在 A / 仅在 B 中的文件
+        for files, marker, label in ((only_in_a, '-', label_a), (only_in_b, '+', label_b)):
+            if not files:
+                continue
+            
+            chats, chars, configs, others = categorize_files(files)
+            buf += ["", f"📂 仅在 {label} 中存在 (共 {len(files)} 个)："]
             
             if chats:
-                print(f"   💬 聊天记录 ({len(chats)} 个):")
-                for f in sorted(chats)[:5]:
-                    print(f"      + {f}")
-                if len(chats) > 5:
-                    print(f"      ... 还有 {len(chats) - 5} 个")
+                buf.append(f"   💬 聊天记录 ({len(chats)} 个):")
+                buf += preview(chats, marker, 5)
             
             if chars:
-                print(f"   👤 角色卡 ({len(chars)} 个):")
-                for f in sorted(chars)[:3]:
-                    print(f"      + {f}")
-                if len(chars) > 3:
-                    print(f"      ... 还有 {len(chars) - 3} 个")
+                buf.append(f"   👤 角色卡 ({len(chars)} 个):")
+                buf += preview(chars, marker, 3)
             
             if configs:
-                print(f"   ⚙️ 配置文件 ({len(configs)} 个):")
-                for f in sorted(configs):
-                    print(f"      + {f}")
+                buf.append(f"   ⚙️ 配置文件 ({len(configs)} 个):")
+                buf += preview(configs, marker)
             
             if others and len(others) <= 5:
-                print(f"   📄 其他文件:")
-                for f in sorted(others):
-                    print(f"      + {f}")
+                buf.append("   📄 其他文件:")
+                buf += preview(others, marker)
         
         # 已修改的文件
         if modified_files:
-            chats, chars, configs, others = categorize_files(modified_files)
-            print()
-            print(f"🔄 已修改的文件 (共 {len(modified_files)} 个)：")
+            chats, chars, configs, others = categorize_files(
+                [item[0] for item in modified_files], modified_files
+            )
+            buf += ["", f"🔄 已修改的文件 (共 {len(modified_files)} 个)："]
             
             if chats:
-                print(f"   💬 聊天记录 ({len(chats)} 个):")
-                for item in sorted(chats, key=lambda x: abs(x[3]) if isinstance(x, tuple) else x, reverse=True)[:5]:
-                    if isinstance(item, tuple):
-                        f, size_a, size_b, diff = item
-                        sign = '+' if diff > 0 else ''
-                        print(f"      ~ {f} ({size_a} → {size_b} bytes, {sign}{diff})")
-                    else:
-                        print(f"      ~ {item}")
+                buf.append(f"   💬 聊天记录 ({len(chats)} 个):")
+                # 显示大小变化最大的 5 个（nlargest 不必对全部条目排序）
+                for f, size_a, size_b, diff in heapq.nlargest(5, chats, key=lambda x: abs(x[3])):
+                    sign = '+' if diff > 0 else ''
+                    buf.append(f"      ~ {f} ({size_a} → {size_b} bytes, {sign}{diff})")
                 if len(chats) > 5:
-                    print(f"      ... 还有 {len(chats) - 5} 个")
+                    buf.append(f"      ... 还有 {len(chats) - 5} 个")
             
             if chars:
-                print(f"   👤 角色卡 ({len(chars)} 个):")
-                for item in sorted(chars)[:3]:
-                    if isinstance(item, tuple):
-                        f = item[0]
-                    else:
-                        f = item
-                    print(f"      ~ {f}")
-                if len(chars) > 3:
-                    print(f"      ... 还有 {len(chars) - 3} 个")
+                buf.append(f"   👤 角色卡 ({len(chars)} 个):")
+                buf += preview([item[0] for item in chars], '~', 3)
             
             if configs:
-                print(f"   ⚙️ 配置文件:")
-                for item in sorted(configs):
-                    if isinstance(item, tuple):
-                        f, size_a, size_b, diff = item
-                        sign = '+' if diff > 0 else ''
-                        print(f"      ~ {f} ({size_a} → {size_b}, {sign}{diff})")
-                    else:
-                        print(f"      ~ {item}")
+                buf.append("   ⚙️ 配置文件:")
+                buf += preview([item[0] for item in configs], '~')
         
         if not only_in_a and not only_in_b and not modified_files:
-            print()
-            print("✅ 两个版本完全一致")
-        
-        print()
-        print("=" * 80)
-        print()
-        print("图例：")
-        print("  - 仅在第一个版本")
-        print("  + 仅在第二个版本")
-        print("  ~ 两个版本都有但内容不同")
-        print("=" * 80)
-        
-        # 返回到最新版本
-        manager.repo.git.checkout('HEAD')
+            buf += ["", "✅ 两个版本完全一致"]
+        
+        buf += [
+            "",
+            _SEP80,
+            "",
+            "图例：",
+            "  - 仅在第一个版本",
+            "  + 仅在第二个版本",
+            "  ~ 两个版本都有但内容不同",
+            _SEP80,
+        ]
+        _write_lines(buf)
         
     except Exception as e:
+        logger.exception(f"比较存档差异失败: {selected_hash1}")
         print(f"❌ 比较失败: {e}")
-        try:
-            manager.repo.git.checkout('HEAD')
-        except:
-            pass
     
     print()
-    input("按回车键继续...")
-    """比较存档与当前数据的差异"""
-    print()
-    print("-" * 60)
-    print("比较存档差异")
-    print("-" * 60)
-    
-    manager = RestoreManager(config)
-    backup_manager = BackupManager(config)
-    
-    if not manager.init_repo():
-        print("❌ 无法连接到备份仓库")
-        input("按回车键继续...")
-        return
-    
-    backups = manager.list_backups(max_count=20)
-    if not backups:
-        print("❌ 没有可用的备份")
-        input("按回车键继续...")
-        return
-    
-    print()
-    print("序号  提交哈希   时间                    描述")
-    print("-" * 80)
-    for i, (hash_val, msg, dt) in enumerate(backups, 1):
-        first_line = msg.split('\n')[0]
-        print(f"{i:2d}.   {hash_val}    {dt.strftime('%Y-%m-%d %H:%M:%S')}  {first_line}")
-    print()
-    
-    # 选择要比较的版本
-    while True:
-        choice = input("请选择要比较的版本（输入序号，或 'q' 取消）: ").strip()
-        if choice.lower() == 'q':
-            return
-        
-        try:
-            index = int(choice) - 1
-            if 0 <= index < len(backups):
-                break
-            else:
-                print("❌ 无效的序号")
-        except ValueError:
-            print("❌ 请输入数字")
-    
-    selected_hash = backups[index][0]
-    
-    print()
-    print("正在分析差异...")
-    
-    try:
-        # 检出选定版本
-        manager.repo.git.checkout(selected_hash)
-        
-        # 比较两个目录
-        backup_data = manager.repo_path / 'data'
-        current_data = backup_manager.data_path
-        
-        if not backup_data.exists():
-            print("❌ 备份中未找到 data 目录")
-            manager.repo.git.checkout('HEAD')
-            input("按回车键继续...")
-            return
-        
-        # 收集文件列表
-        backup_files = set()
-        current_files = set()
-        
-        for item in backup_data.rglob('*'):
-            if item.is_file():
-                rel_path = item.relative_to(backup_data)
-                backup_files.add(str(rel_path))
-        
-        for item in current_data.rglob('*'):
-            if item.is_file():
-                rel_path = item.relative_to(current_data)
-                current_files.add(str(rel_path))
-        
-        # 分析差异
-        only_in_backup = backup_files - current_files
-        only_in_current = current_files - backup_files
-        common_files = backup_files & current_files
-        
-        # 检查共同文件的修改
-        modified_files = []
-        for rel_path in common_files:
-            backup_file = backup_data / rel_path
-            current_file = current_data / rel_path
-            
-            # 简单比较文件大小（可以改用哈希比较）
-            if backup_file.stat().st_size != current_file.stat().st_size:
-                modified_files.append(rel_path)
-        
-        # 显示结果
-        print()
-        print("=" * 60)
-        print("差异分析结果")
-        print("=" * 60)
-        
-        if only_in_backup:
-            print()
-            print(f"📂 仅在备份中存在 ({len(only_in_backup)} 个文件)：")
-            for f in sorted(list(only_in_backup)[:10]):
-                print(f"   - {f}")
-            if len(only_in_backup) > 10:
-                print(f"   ... 还有 {len(only_in_backup) - 10} 个文件")
-        
-        if only_in_current:
-            print()
-            print(f"📂 仅在当前数据中存在 ({len(only_in_current)} 个文件)：")
-            for f in sorted(list(only_in_current)[:10]):
-                print(f"   + {f}")
-            if len(only_in_current) > 10:
-                print(f"   ... 还有 {len(only_in_current) - 10} 个文件")
-        
-        if modified_files:
-            print()
-            print(f"🔄 已修改的文件 ({len(modified_files)} 个)：")
-            for f in sorted(modified_files[:10]):
-                print(f"   ~ {f}")
-            if len(modified_files) > 10:
-                print(f"   ... 还有 {len(modified_files) - 10} 个文件")
-        
-        if not only_in_backup and not only_in_current and not modified_files:
-            print()
-            print("✅ 备份与当前数据完全一致")
-        
-        print()
-        print("=" * 60)
-        
-        # 返回到最新版本
-        manager.repo.git.checkout('HEAD')
-        
-    except Exception as e:
-        print(f"❌ 比较失败: {e}")
-        try:
-            manager.repo.git.checkout('HEAD')
-        except:
-            pass
-    
-    print()
-    input("按回车键继续...")
+    _pause()
 
 
 def main():
     """主函数"""
+    global _ASSUME_YES
+    _ASSUME_YES = '--yes' in sys.argv[1:]
+    
+    if _INTERACTIVE:
+        # 导入 readline 后 input() 支持行编辑，方向键上可以找回之前输入的序号
+        try:
+            import readline  # noqa: F401
+        except ImportError:  # Windows 等没有 readline 的平台照常使用普通输入
+            pass
+    
     setup_logger()
     
     try:
@@ -905,7 +741,6 @@ def main():
         while True:
             show_menu()
             choice = input("请选择操作 (0-5): ").strip()
-            choice = input("请选择操作 (0-6): ").strip()
             
             if choice == '1':
                 manual_backup(config)
@@ -917,10 +752,6 @@ def main():
                 delete_backup(config)
             elif choice == '5':
                 compare_diff(config)
-            elif choice == '6':
-                # Placeholder for new functionality
-                print("新功能待实现...")
-                input("按回车键继续...")
             elif choice == '0':
                 print()
                 print("再见！")
@@ -928,13 +759,17 @@ def main():
             else:
                 print()
                 print("❌ 无效的选择，请输入 0-5")
-                input("按回车键继续...")
+                _pause()
     
     except KeyboardInterrupt:
         print("\n\n已取消")
         return 0
+    except EOFError:
+        # 输入已结束（管道输入读完或按下 Ctrl+D）：视为正常退出
+        print()
+        return 0
     except Exception as e:
-        logger.error(f"程序异常: {e}", exc_info=True)
+        logger.exception(f"程序异常: {e}")
         return 1
 
 
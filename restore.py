@@ -7,16 +7,121 @@
 
 import logging
 import os
+import shlex
 import shutil
+import stat
 import sys
+import tarfile
+import tempfile
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, NamedTuple
 
 import git
 
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，备份当前数据时直接复制文件内容
+    fcntl = None
+
+from config import resolve_data_path
+
 logger = logging.getLogger(__name__)
 
+# 备份列表中的时间格式
+_TS_FMT = '%Y-%m-%d %H:%M:%S'
+
+# 首次克隆时取回的提交数（备份列表只显示最近 20 个版本）
+_CLONE_DEPTH = 50
+
+# Linux 的 FICLONE ioctl：btrfs / XFS 等写时复制文件系统上只共享数据块，不复制内容
+_FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+
+# 第一次 FICLONE 失败（文件系统不支持、跨文件系统）后本进程内不再尝试
+_reflink_supported = fcntl is not None and sys.platform.startswith('linux')
+
+
+def _clone_or_copy(src, dst):
+    """复制单个文件（copytree 的 copy_function）：优先克隆数据块，不支持时退回 shutil.copy2"""
+    global _reflink_supported
+    if _reflink_supported:
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError as e:
+            logger.debug(f"无法克隆文件数据块，改为复制内容: {e}")
+            _reflink_supported = False
+    return shutil.copy2(src, dst)
+
+
+def _refresh_copy(src_dir, dst_dir):
+    """
+    让副本与源目录重新一致，返回更新的条目数
+    copytree 的副本保留了修改时间：大小和修改时间都相同的文件视为未变化；
+    其余文件重新复制，源目录中已不存在的条目从副本中删除
+    """
+    updated = 0
+    names = set()
+    with os.scandir(src_dir) as entries:
+        for entry in entries:
+            names.add(entry.name)
+            target = os.path.join(dst_dir, entry.name)
+            try:
+                if entry.is_dir():
+                    if os.path.isdir(target) and not os.path.islink(target):
+                        updated += _refresh_copy(entry.path, target)
+                        continue
+                    if os.path.lexists(target):
+                        os.unlink(target)
+                    shutil.copytree(entry.path, target, copy_function=_clone_or_copy)
+                    updated += 1
+                elif entry.is_file():
+                    src_stat = entry.stat()
+                    try:
+                        dst_stat = os.stat(target, follow_symlinks=False)
+                    except FileNotFoundError:
+                        dst_stat = None
+                    
+                    if dst_stat is not None:
+                        if (stat.S_ISREG(dst_stat.st_mode)
+                                and dst_stat.st_size == src_stat.st_size
+                                and dst_stat.st_mtime_ns == src_stat.st_mtime_ns):
+                            continue
+                        if stat.S_ISDIR(dst_stat.st_mode):
+                            shutil.rmtree(target)
+                    _clone_or_copy(entry.path, target)
+                    updated += 1
+            except FileNotFoundError:
+                # 比对期间源文件被删除：按已删除处理，副本中的旧版本在下面清理
+                names.discard(entry.name)
+    
+    with os.scandir(dst_dir) as entries:
+        for entry in entries:
+            if entry.name in names:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
+            updated += 1
+    return updated
+
+
+class _CopyCancelled(Exception):
+    """后台备份当前数据被取消（用户放弃恢复）"""
+
+
+class BackupEntry(NamedTuple):
+    """一个备份版本（list_backups 的返回项）"""
+    sha: str  # 短哈希
+    msg: str  # 完整描述
+    dt: datetime  # 备份时间（作者时间）
+    first_line: str  # 描述第一行（构造时取一次，显示时不再重复切分）
+
 
 class RestoreManager:
     """恢复管理器"""
@@ -25,39 +130,41 @@ class RestoreManager:
         """初始化恢复管理器"""
         self.config = config
         
-        # Docker 环境检测
-        is_docker = os.path.exists('/.dockerenv')
-        
-        if is_docker:
-            # 容器内运行，使用固定的容器内路径
-            self.data_path = Path('/data')
-            logger.info("Docker 环境：使用容器内数据路径 /data")
-        else:
-            # 宿主机运行，使用配置的路径
-            self.data_path = Path(config['sillytavern_data_path'])
-            logger.info(f"宿主机环境：使用配置路径 {self.data_path}")
+        # 数据目录（Docker / 宿主机）由配置模块统一解析
+        self.data_path = resolve_data_path(config['sillytavern_data_path'])
         
         self.repo_path = Path(config['backup_repo_path'])
         self.remote_url = config['github_remote_url']
         self.repo = None
+        
+        # 后台备份当前数据：(线程, 备份路径, 结果, 取消事件)
+        self._pending_backup = None
     
     def init_repo(self):
         """初始化或克隆仓库"""
         try:
-            if self.repo_path.exists() and (self.repo_path / '.git').exists():
-                # 打开现有仓库
-                self.repo = git.Repo(self.repo_path)
-                logger.info(f"已打开现有仓库: {self.repo_path}")
+            if self.repo is not None or (self.repo_path / '.git').exists():
+                # 打开现有仓库（已由备份管理器打开时直接复用同一个 Repo 对象）
+                if self.repo is None:
+                    self.repo = git.Repo(self.repo_path, odbt=git.GitCmdObjectDB)
+                    logger.info(f"已打开现有仓库: {self.repo_path}")
                 
-                # 拉取最新数据
-                origin = self.repo.remote('origin')
-                origin.fetch()
-                logger.info("已从远程仓库拉取最新数据")
+                # 拉取最新数据（距上次拉取不到 FETCH_CACHE_SECONDS 秒时跳过）
+                if self._fetched_recently():
+                    logger.info("最近已从远程仓库拉取，跳过本次拉取")
+                else:
+                    origin = self.repo.remote('origin')
+                    origin.fetch()
+                    logger.info("已从远程仓库拉取最新数据")
             else:
                 # 克隆仓库
                 logger.info(f"正在克隆仓库: {self.remote_url}")
                 self.repo_path.mkdir(parents=True, exist_ok=True)
-                self.repo = git.Repo.clone_from(self.remote_url, self.repo_path)
+                # 浅克隆：只取回最近的提交，不下载更早的历史和标签
+                self.repo = git.Repo.clone_from(
+                    self.remote_url, self.repo_path, odbt=git.GitCmdObjectDB,
+                    depth=_CLONE_DEPTH, no_tags=True
+                )
                 logger.info("仓库克隆完成")
             
             return True
@@ -65,79 +172,250 @@ class RestoreManager:
             logger.error(f"初始化仓库失败: {e}")
             return False
     
-    def list_backups(self, max_count: int = 20) -> List[Tuple[str, str, datetime]]:
+    def _fetched_recently(self) -> bool:
+        """上次 fetch 是否仍在缓存时间内（git 每次 fetch 都会重写 FETCH_HEAD）"""
+        max_age = self.config.get('fetch_cache_seconds', 60)
+        if max_age <= 0:
+            return False
+        try:
+            mtime = (Path(self.repo.git_dir) / 'FETCH_HEAD').stat().st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - mtime < max_age
+    
+    def list_backups(self, max_count: int = 20) -> List[BackupEntry]:
         """
         列出可用的备份版本
-        返回：[(commit_hash, message, datetime), ...]
+        返回：[BackupEntry(sha, msg, dt, first_line), ...]
         """
         try:
+            # 一次 git log 取回全部字段，-n 限制遍历的提交数量
+            # 字段以 NUL 分隔、记录以 RS (0x1e) 结尾，提交描述中可以包含任意换行
+            # --no-show-signature：即使用户开启了 log.showSignature，也不为每个提交调用 gpg 验签
+            # 显示作者时间（%at）：修改描述（amend / rebase）不会改变备份的创建时间
+            output = self.repo.git.log(
+                f'--max-count={max_count}', '--no-show-signature',
+                '--format=%h%x00%at%x00%B%x1e', 'HEAD'
+            )
+            
             backups = []
-            for commit in self.repo.iter_commits('HEAD', max_count=max_count):
-                backups.append((
-                    commit.hexsha[:7],  # 短哈希
-                    commit.message.strip(),
-                    datetime.fromtimestamp(commit.committed_date)
+            for record in output.split('\x1e'):
+                record = record.lstrip('\n')
+                if not record:
+                    continue
+                short_hash, timestamp, message = record.split('\0', 2)
+                message = message.strip()
+                backups.append(BackupEntry(
+                    short_hash,
+                    message,
+                    datetime.fromtimestamp(int(timestamp)),
+                    message.partition('\n')[0]
                 ))
             return backups
         except Exception as e:
             logger.error(f"列出备份失败: {e}")
             return []
     
-    def backup_current_data(self) -> Path:
+    def modify_commit_message(self, commit_hash: str, new_message: str) -> bool:
         """
-        备份当前的 SillyTavern 数据到临时目录
-        返回备份路径
+        修改历史提交的描述
+        通过一次非交互的 git rebase -i 把目标提交标记为 reword，
+        后续提交在同一个 rebase 进程内依次重写
         """
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_path = Path(f"/tmp/st-backup-{timestamp}")
+        commit = self.repo.commit(commit_hash)
+        
+        with tempfile.NamedTemporaryFile(
+            'w', encoding='utf-8', suffix='.txt', delete=False
+        ) as f:
+            f.write(new_message + '\n')
+            message_file = f.name
         
         try:
-            if self.data_path.exists():
-                shutil.copytree(self.data_path, backup_path)
-                logger.info(f"当前数据已备份到: {backup_path}")
+            env = {
+                # 待办列表的第一行就是目标提交，改为 reword
+                'GIT_SEQUENCE_EDITOR': "sed -i -e '1s/^pick /reword /'",
+                # reword 时用新描述覆盖提交信息文件
+                'GIT_EDITOR': f'cp {shlex.quote(Path(message_file).as_posix())}',
+            }
+            base = [f'{commit.hexsha}^'] if commit.parents else ['--root']
+            # 沿用原提交者身份（容器内通常没有配置 git user，--root 重写根提交时也需要）
+            identity = [
+                f'user.name={commit.committer.name}',
+                f'user.email={commit.committer.email}',
+            ]
+            # --committer-date-is-author-date：重写后的提交保留原来的时间，备份列表的时间不会变成“现在”
+            self.repo.git(c=identity).rebase(
+                '-i', '--autostash', '--committer-date-is-author-date', *base, env=env
+            )
+            logger.info(f"已修改提交描述: {commit_hash}")
+            return True
+        except Exception as e:
+            logger.error(f"修改提交描述失败: {e}")
+            try:
+                self.repo.git.rebase('--abort')
+            except git.exc.GitCommandError:
+                pass
+            return False
+        finally:
+            os.unlink(message_file)
+    
+    def _extract_archive(self, target_dir: Path, *archive_args):
+        """把 git archive 的 tar 流直接解包到 target_dir（不落地临时归档文件）"""
+        proc = self.repo.git.archive(*archive_args, format='tar', as_process=True)
+        with tarfile.open(fileobj=proc.stdout, mode='r|') as archive:
+            # 归档来自自己的仓库，filter='data' 仍然拒绝绝对路径和越界链接
+            if hasattr(tarfile, 'data_filter'):
+                archive.extractall(target_dir, filter='data')
             else:
-                logger.warning(f"源目录不存在，跳过备份: {self.data_path}")
+                archive.extractall(target_dir)
+        proc.wait()
+    
+    def export_version(self, commit_hash: str, target_dir: Path) -> bool:
+        """
+        把指定版本的 data/ 目录导出到 target_dir
+        git archive 的 tar 流直接解包，不检出版本，备份仓库的 HEAD 和工作区保持不变
+        """
+        try:
+            tree = self.repo.commit(commit_hash).tree
+            if 'data' not in tree:
+                raise FileNotFoundError("备份中未找到 data 目录，可能是旧版本备份")
+            
+            if target_dir.exists():
+                shutil.rmtree(target_dir)
+            target_dir.mkdir(parents=True)
+            
+            self._extract_archive(target_dir, commit_hash, 'data/')
             
-            return backup_path
+            logger.info(f"已导出版本 {commit_hash} 到: {target_dir}")
+            return True
         except Exception as e:
-            logger.error(f"备份当前数据失败: {e}")
+            logger.error(f"导出版本失败: {e}")
+            return False
+    
+    def _start_backup_current_data(self):
+        """
+        在后台线程中开始备份当前数据到临时目录
+        复制与用户选择版本、确认操作同时进行；结果（及日志）由 _finish_backup_current_data 取回，
+        不会在用户输入时插入日志
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_path = Path(f"/tmp/st-backup-{timestamp}")
+        # 先复制到 .partial 目录，完成后再改名：中途按 Ctrl+C 退出时不会留下看似完整的备份
+        partial_path = backup_path.with_name(backup_path.name + '.partial')
+        cancel = threading.Event()
+        outcome = {}
+        
+        def copy_file(src, dst):
+            # 取消后在下一个文件前中止（copytree 会收集每个文件的 OSError 并继续，这里抛出非 OSError 异常）
+            if cancel.is_set():
+                raise _CopyCancelled()
+            return _clone_or_copy(src, dst)
+        
+        def worker():
+            try:
+                if self.data_path.exists():
+                    shutil.copytree(self.data_path, partial_path, copy_function=copy_file)
+                    os.rename(partial_path, backup_path)
+                    outcome['copied'] = True
+            except _CopyCancelled:
+                shutil.rmtree(partial_path, ignore_errors=True)
+            except Exception as e:
+                outcome['error'] = e
+                shutil.rmtree(partial_path, ignore_errors=True)
+        
+        thread = threading.Thread(target=worker, name='current-data-backup', daemon=True)
+        thread.start()
+        self._pending_backup = (thread, backup_path, outcome, cancel)
+    
+    def _finish_backup_current_data(self) -> Path:
+        """等待后台备份完成，返回备份路径（失败返回 None）"""
+        thread, backup_path, outcome, _ = self._pending_backup
+        self._pending_backup = None
+        thread.join()
+        
+        if 'error' in outcome:
+            logger.error(f"备份当前数据失败: {outcome['error']}")
             return None
+        if outcome.get('copied'):
+            # 复制与用户选择同时进行，期间 SillyTavern 可能又写入了文件（例如自动保存）：
+            # 恢复前再比对一次，把这些改动补进副本，否则它们既不在副本中、又会被恢复覆盖
+            try:
+                updated = _refresh_copy(str(self.data_path), str(backup_path))
+                if updated:
+                    logger.debug(f"复制期间有 {updated} 个条目发生变化，已更新到副本")
+            except Exception as e:
+                logger.warning(f"更新备份副本失败，副本可能缺少最近的改动: {e}")
+            logger.info(f"当前数据已备份到: {backup_path}")
+        else:
+            logger.warning(f"源目录不存在，跳过备份: {self.data_path}")
+        return backup_path
+    
+    def _discard_backup_current_data(self):
+        """取消恢复时中止后台备份（只需等待正在复制的那个文件），并删除已复制的部分"""
+        thread, backup_path, _, cancel = self._pending_backup
+        self._pending_backup = None
+        cancel.set()
+        thread.join()
+        # 取消前复制已经完成时删除完整的副本
+        shutil.rmtree(backup_path, ignore_errors=True)
+    
+    def backup_current_data(self) -> Path:
+        """
+        备份当前的 SillyTavern 数据到临时目录
+        返回备份路径
+        """
+        self._start_backup_current_data()
+        return self._finish_backup_current_data()
+    
+    def _restore_env(self):
+        """
+        恢复使用的环境变量：独立的索引文件，工作区直接指向 SillyTavern 数据目录
+        索引记录上次恢复后各文件的 stat 信息，下次恢复时未变化的文件不必重新读取
+        """
+        return {
+            'GIT_INDEX_FILE': os.path.join(self.repo.git_dir, 'restore_index'),
+            'GIT_WORK_TREE': str(self.data_path),
+        }
     
     def restore_version(self, commit_hash: str):
-        """恢复指定版本"""
+        """
+        恢复指定版本
+        按差异增量恢复：只改写内容与该版本不同或缺失的文件，删除版本中没有的本地文件；
+        不检出版本，备份仓库保持在最新提交
+        """
         try:
-            # 1. 检出指定版本
-            self.repo.git.checkout(commit_hash)
-            logger.info(f"已检出版本: {commit_hash}")
-            
-            # 2. 复制文件到 SillyTavern 目录
-            if self.data_path.exists():
-                # 删除目标目录内容（保留目录本身）
-                for item in self.data_path.iterdir():
-                    if item.is_file():
-                        item.unlink()
-                    elif item.is_dir():
-                        shutil.rmtree(item)
-            else:
-                self.data_path.mkdir(parents=True, exist_ok=True)
+            # 1. 确认备份中有 data 目录（在改动目标目录之前检查）
+            if 'data' not in self.repo.commit(commit_hash).tree:
+                raise FileNotFoundError(f"备份 {commit_hash} 中未找到 data 目录")
             
+            self.data_path.mkdir(parents=True, exist_ok=True)
+            env = self._restore_env()
             
-            # 复制所有文件（从 backup/data/ 恢复到目标）
-            backup_data_path = self.repo_path / 'data'
-            if not backup_data_path.exists():
-                raise FileNotFoundError(f"备份中未找到 data 目录: {backup_data_path}")
+            # 2. 把该版本的 data/ 子树读入恢复索引（路径相对于数据目录）
+            # --reset：与索引中内容相同的条目沿用已有的 stat 信息
+            self.repo.git.read_tree('--reset', f'{commit_hash}:data', env=env)
+            # 刷新 stat 信息：只有 stat 变化的本地文件才需要重新计算哈希（有差异时返回非零，属正常情况）
+            self.repo.git.update_index('-q', '--refresh', env=env, with_exceptions=False)
             
-            for item in backup_data_path.rglob('*'):
-                if item.is_file():
-                    relative_path = item.relative_to(backup_data_path)
-                    target = self.data_path / relative_path
-                    target.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copy2(item, target)
+            # 3. 删除该版本中不存在的本地条目（--directory：整个目录都不在版本中时只列出目录本身）
+            others_out = self.repo.git.ls_files('--others', '--directory', '-z', env=env)
+            removed = 0
+            for rel_path in others_out.split('\0'):
+                if not rel_path:
+                    continue
+                path = self.data_path / rel_path
+                if rel_path.endswith('/'):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+                removed += 1
             
-            logger.info(f"文件已恢复到: {self.data_path}")
+            # 4. 写出内容不同或缺失的文件（与索引一致的文件会被 checkout-index 跳过）
+            # checkout.workers：由 git 的并行检出用多个进程写文件（RESTORE_CONCURRENCY，1 为顺序写出）
+            workers = self.config.get('restore_concurrency', 8)
+            self.repo.git(c=f'checkout.workers={workers}').checkout_index('-a', '-f', '-u', env=env)
             
-            # 3. 返回到最新版本（避免 detached HEAD）
-            self.repo.git.checkout('HEAD')
+            logger.info(f"文件已恢复到: {self.data_path}（删除 {removed} 个多余条目）")
             
             return True
         except Exception as e:
@@ -162,35 +440,42 @@ class RestoreManager:
             print("❌ 没有可用的备份")
             return False
         
+        # 用户浏览列表、确认期间就在后台备份当前数据
+        self._start_backup_current_data()
+        
         print(f"找到 {len(backups)} 个备份版本：")
         print()
-        print("序号  提交哈希  时间                    描述")
-        print("-" * 60)
-        for i, (hash, msg, dt) in enumerate(backups, 1):
-            print(f"{i:2d}.   {hash}    {dt.strftime('%Y-%m-%d %H:%M:%S')}  {msg[:30]}")
-        print()
+        rows = ["序号  提交哈希  时间                    描述", "-" * 60]
+        for i, entry in enumerate(backups, 1):
+            rows.append(f"{i:2d}.   {entry.sha}    {entry.dt.strftime(_TS_FMT)}  {entry.first_line[:30]}")
+        rows.append("")
+        # 整张列表一次写出
+        sys.stdout.write('\n'.join(rows) + '\n')
+        sys.stdout.flush()
         
         # 3. 选择版本
         while True:
-            try:
-                choice = input("请选择要恢复的版本（输入序号，或 'q' 退出）: ").strip()
-                if choice.lower() == 'q':
-                    print("已取消")
-                    return False
-                
-                index = int(choice) - 1
-                if 0 <= index < len(backups):
-                    selected_hash = backups[index][0]
-                    selected_msg = backups[index][1]
-                    selected_time = backups[index][2]
-                    break
-                else:
-                    print("❌ 无效的序号，请重新输入")
-            except ValueError:
+            choice = input("请选择要恢复的版本（输入序号，或 'q' 退出）: ").strip()
+            if choice.lower() == 'q':
+                self._discard_backup_current_data()
+                print("已取消")
+                return False
+            
+            # 先用 isdecimal 判断，非数字输入不必经过 int() 抛出异常
+            if not choice.isdecimal():
                 print("❌ 请输入数字")
+                continue
+            
+            index = int(choice) - 1
+            if 0 <= index < len(backups):
+                selected_hash = backups[index].sha
+                selected_msg = backups[index].msg
+                selected_time = backups[index].dt
+                break
+            print("❌ 无效的序号，请重新输入")
         
         print()
-        print(f"您选择的版本: {selected_hash} - {selected_time.strftime('%Y-%m-%d %H:%M:%S')}")
+        print(f"您选择的版本: {selected_hash} - {selected_time.strftime(_TS_FMT)}")
         print(f"描述: {selected_msg}")
         print()
         
@@ -201,14 +486,15 @@ class RestoreManager:
         
         confirm = input("确认继续？(yes/no): ").strip().lower()
         if confirm not in ['yes', 'y']:
+            self._discard_backup_current_data()
             print("已取消")
             return False
         
         print()
         
-        # 5. 备份当前数据
+        # 5. 备份当前数据（后台复制通常已经完成，这里补上复制期间发生的改动）
         print("正在备份当前数据...")
-        backup_path = self.backup_current_data()
+        backup_path = self._finish_backup_current_data()
         if backup_path:
             print(f"✅ 当前数据已备份到: {backup_path}")
         print()
@@ -221,7 +507,7 @@ class RestoreManager:
             print("✅ 恢复完成！")
             print("=" * 60)
             print(f"恢复的版本: {selected_hash}")
-            print(f"时间: {selected_time.strftime('%Y-%m-%d %H:%M:%S')}")
+            print(f"时间: {selected_time.strftime(_TS_FMT)}")
             if backup_path:
                 print(f"原数据备份: {backup_path}")
             print("=" * 60)
@@ -244,6 +530,10 @@ def run_restore():
     try:
         config = load_config()
         
+        # --force-fetch：忽略拉取缓存，总是从远程仓库拉取
+        if '--force-fetch' in sys.argv[1:]:
+            config['fetch_cache_seconds'] = 0
+        
         manager = RestoreManager(config)
         return manager.run_interactive_restore()
     except KeyboardInterrupt: